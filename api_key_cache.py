@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Negative cache for API keys the Lemon Email API has rejected
+Lets the public web API turn away revoked or mistyped keys without an
+upstream round-trip
+"""
+
+import hashlib
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict
+
+# Upstream statuses passed back to the caller as-is rather than as a 400
+REJECTED_STATUSES = {401, 403}
+# A 403 can forbid just this send (e.g. an unverified fromemail), so it only
+# marks the key bad when the body says the key itself is the problem
+INVALID_KEY_BODY = re.compile(
+    r"invalid\W+(?:api\W*)?key|(?:api\W*)?key\W+(?:is\W+)?(?:invalid|revoked|expired|disabled)",
+    re.IGNORECASE,
+)
+
+
+def rejects_key(status_code: Any, body: Any = None) -> bool:
+    """True when an upstream reply means this API key will not work at all"""
+    if status_code == 401:
+        return True
+    if status_code != 403 or body is None:
+        return False
+    text = body if isinstance(body, str) else json.dumps(body)
+    return INVALID_KEY_BODY.search(text) is not None
+
+
+def hash_api_key(api_key: str) -> str:
+    """Stable, non-reversible identifier for an API key (safe to log or store)"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+class NegativeKeyCache:
+    """Bounded LRU of recently rejected key hashes with a short TTL"""
+
+    def __init__(self, ttl: float = 60.0, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # sha256 digest -> expires_at; raw keys are never kept in memory
+        self._entries: "OrderedDict[bytes, float]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls) -> "NegativeKeyCache":
+        return cls(
+            ttl=float(os.getenv("LEMON_EMAIL_BAD_KEY_TTL", "60")),
+            max_entries=int(os.getenv("LEMON_EMAIL_BAD_KEY_CACHE_SIZE", "10000")),
+        )
+
+    @staticmethod
+    def _digest(api_key: str) -> bytes:
+        return hashlib.sha256(api_key.encode("utf-8")).digest()
+
+    def is_rejected(self, api_key: str) -> bool:
+        """True if upstream rejected this key within the TTL"""
+        digest = self._digest(api_key)
+        expires_at = self._entries.get(digest)
+        if expires_at is not None:
+            if expires_at > time.monotonic():
+                self.hits += 1
+                return True
+            del self._entries[digest]
+        self.misses += 1
+        return False
+
+    def reject(self, api_key: str):
+        digest = self._digest(api_key)
+        self._entries[digest] = time.monotonic() + self.ttl
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def forget(self, api_key: str):
+        self._entries.pop(self._digest(api_key), None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
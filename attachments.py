@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Streaming attachment support for the Lemon Email API
+Attachments are read and base64-encoded chunk by chunk straight into a
+streamed JSON request body (optionally gzip-compressed), so peak memory
+stays near the chunk size instead of holding several copies of each file
+"""
+
+import asyncio
+import base64
+import mimetypes
+import os
+import threading
+import zlib
+from typing import Any, AsyncIterator, BinaryIO, Callable, Dict, List, Optional
+from urllib.parse import unquote, urlparse
+
+# Multiple of 3 so each chunk's base64 concatenates without padding in between
+CHUNK_SIZE = 3 * 16 * 1024
+MAX_ATTACHMENT_BYTES = int(float(os.getenv("LEMON_EMAIL_MAX_ATTACHMENT_MB", "25")) * 1024 * 1024)
+GZIP_ATTACHMENTS = os.getenv("LEMON_EMAIL_GZIP_ATTACHMENTS", "").lower() in ("1", "true", "yes")
+# Local files may only be attached from under this directory; unset disables path attachments
+ATTACHMENT_DIR = os.getenv("LEMON_EMAIL_ATTACHMENT_DIR")
+
+
+class AttachmentError(ValueError):
+    """Raised for attachments that cannot be read or exceed the size cap"""
+
+
+class SharedFileReader:
+    """A private read position over a file that concurrent attempts share
+
+    Hedged attempts stream the same upload at once; each gets its own reader,
+    and seek+read pairs are serialized so their offsets never interleave.
+    """
+
+    def __init__(self, fileobj: BinaryIO, lock: threading.Lock):
+        self._fileobj = fileobj
+        self._lock = lock
+        self._offset = 0
+
+    def read(self, size: int) -> bytes:
+        with self._lock:
+            self._fileobj.seek(self._offset)
+            data = self._fileobj.read(size)
+        self._offset += len(data)
+        return data
+
+    def close(self):
+        # The underlying file belongs to the caller (e.g. the upload)
+        pass
+
+
+class AttachmentSource:
+    """A named file that is opened afresh for each send attempt"""
+
+    def __init__(self, filename: str, content_type: Optional[str], opener: Callable[[], BinaryIO],
+                 size: Optional[int] = None):
+        self.filename = filename
+        self.content_type = content_type or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        # Must return an independent handle per call: hedged attempts run concurrently
+        self.opener = opener
+        self.size = size
+
+    @classmethod
+    def from_path(cls, path: str, filename: Optional[str] = None, content_type: Optional[str] = None,
+                  max_bytes: int = MAX_ATTACHMENT_BYTES, root: Optional[str] = ATTACHMENT_DIR) -> "AttachmentSource":
+        """A local file under ``root``; relative paths are taken relative to it"""
+        if not root:
+            raise AttachmentError("Local file attachments are disabled (set LEMON_EMAIL_ATTACHMENT_DIR)")
+        root = os.path.realpath(os.path.expanduser(root))
+        real = os.path.realpath(os.path.join(root, os.path.expanduser(path)))
+        if os.path.commonpath([root, real]) != root:
+            raise AttachmentError(f"Attachment {path} is outside the allowed directory")
+        if not os.path.isfile(real):
+            raise AttachmentError(f"Attachment not found: {path}")
+        size = os.path.getsize(real)
+        if size > max_bytes:
+            raise AttachmentError(f"Attachment {path} is {size} bytes (limit {max_bytes})")
+        return cls(filename or os.path.basename(real), content_type, lambda: open(real, "rb"), size)
+
+    @classmethod
+    def from_fileobj(cls, fileobj: BinaryIO, filename: str, content_type: Optional[str] = None,
+                     size: Optional[int] = None, max_bytes: int = MAX_ATTACHMENT_BYTES) -> "AttachmentSource":
+        """Wrap an already-open seekable binary file (e.g. an upload)"""
+        if size is not None and size > max_bytes:
+            raise AttachmentError(f"Attachment {filename} is {size} bytes (limit {max_bytes})")
+        lock = threading.Lock()
+        return cls(filename, content_type, lambda: SharedFileReader(fileobj, lock), size)
+
+    @classmethod
+    def from_spec(cls, spec: Dict[str, Any], max_bytes: int = MAX_ATTACHMENT_BYTES,
+                  root: Optional[str] = ATTACHMENT_DIR) -> "AttachmentSource":
+        """``{"path" | "url", "filename"?, "content_type"?}`` as accepted by the MCP tool"""
+        path = spec.get("path")
+        url = spec.get("url")
+        if url:
+            parsed = urlparse(url)
+            if parsed.scheme != "file" or parsed.netloc not in ("", "localhost"):
+                raise AttachmentError(f"Only file:// URLs to local files are supported: {url}")
+            path = unquote(parsed.path)
+        if not path:
+            raise AttachmentError("Attachment needs a 'path' or a file:// 'url'")
+        return cls.from_path(path, spec.get("filename"), spec.get("content_type"), max_bytes, root)
+
+    def describe(self) -> Dict[str, Any]:
+        """Metadata only, e.g. for pending records that cannot hold file content"""
+        return {"filename": self.filename, "content_type": self.content_type, "size": self.size}
+
+    async def iter_base64(self, chunk_size: int = CHUNK_SIZE, max_bytes: int = MAX_ATTACHMENT_BYTES) -> AsyncIterator[bytes]:
+        """Base64 of the file, one chunk at a time; file reads run off the event loop"""
+        f = await asyncio.to_thread(self.opener)
+        total = 0
+        try:
+            while True:
+                chunk = await asyncio.to_thread(f.read, chunk_size)
+                if not chunk:
+                    return
+                total += len(chunk)
+                if total > max_bytes:
+                    raise AttachmentError(f"Attachment {self.filename} exceeds {max_bytes} bytes")
+                yield base64.b64encode(chunk)
+        finally:
+            f.close()
+
+
+async def stream_json_body(encoded_payload: bytes, attachments: List[AttachmentSource],
+                           dumps: Callable[[Any], bytes]) -> AsyncIterator[bytes]:
+    """The payload JSON with an ``attachments`` array streamed into it
+
+    ``encoded_payload`` is the already-encoded JSON object without attachments;
+    each attachment becomes ``{"filename", "contentType", "content": <base64>}``.
+    """
+    yield encoded_payload[:-1] + b',"attachments":['
+    for index, attachment in enumerate(attachments):
+        meta = dumps({"filename": attachment.filename, "contentType": attachment.content_type})
+        yield (b"," if index else b"") + meta[:-1] + b',"content":"'
+        async for chunk in attachment.iter_base64():
+            yield chunk
+        yield b'"}'
+    yield b"]}"
+
+
+async def gzip_stream(chunks: AsyncIterator[bytes], level: int = 6) -> AsyncIterator[bytes]:
+    """gzip-compress a byte stream incrementally"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def request_body(encoded_payload: bytes, attachments: List[AttachmentSource], dumps: Callable[[Any], bytes],
+                 gzip: bool = GZIP_ATTACHMENTS) -> Callable[[], AsyncIterator[bytes]]:
+    """Factory for a fresh body stream per send attempt (failover/hedging re-send)"""
+    def body() -> AsyncIterator[bytes]:
+        stream = stream_json_body(encoded_payload, attachments, dumps)
+        return gzip_stream(stream) if gzip else stream
+    return body
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+Compact in-memory backlog for bulk and campaign sends
+Queued messages are __slots__ records that point at interned, content-hashed
+shared fields (subject, body, sender name, tag, body format, API key). Past a
+memory budget new records spill to memory-mapped segment files together with
+their shared fields, so a very large backlog costs disk rather than RSS
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+# Shared fields are interned; per-message fields are stored inline
+SHARED_FIELDS = ("subject", "body", "fromname", "tag", "body_format")
+INLINE_FIELDS = ("to", "toname", "fromemail", "replyto", "variables")
+
+# Spilled messages: segment offsets of their shared strings, then the API key's
+# intern id (keys stay in memory so they are never written to disk)
+_SPILLED = struct.Struct("<5QI")
+_LEN = struct.Struct("<I")
+_NONE = 0xFFFFFFFF
+_DIGEST_SIZE = 16
+# Segment entry kinds
+_STRING = b"S"
+_MESSAGE = b"M"
+# Recently written/emitted shared strings remembered to skip repeats; bounded
+# so personalised campaigns (a unique body per message) keep memory flat
+RECENT_STRINGS = 1024
+
+
+def digest_of(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=_DIGEST_SIZE).digest()
+
+
+class InternPool:
+    """Reference-counted store of shared strings keyed by content hash"""
+
+    def __init__(self):
+        self._ids: Dict[bytes, int] = {}
+        self._values: List[Optional[str]] = []
+        self._digests: List[Optional[bytes]] = []
+        self._refs: List[int] = []
+        self._free: List[int] = []
+        self.bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def intern(self, value: str) -> int:
+        """Id for ``value``, adding one reference"""
+        digest = digest_of(value.encode("utf-8"))
+        index = self._ids.get(digest)
+        if index is None:
+            if self._free:
+                index = self._free.pop()
+                self._values[index], self._digests[index], self._refs[index] = value, digest, 0
+            else:
+                index = len(self._values)
+                self._values.append(value)
+                self._digests.append(digest)
+                self._refs.append(0)
+            self._ids[digest] = index
+            self.bytes += sys.getsizeof(value)
+        self._refs[index] += 1
+        return index
+
+    def get(self, index: int) -> str:
+        return self._values[index]
+
+    def digest(self, index: int) -> bytes:
+        """Content hash of a string, stable across processes"""
+        return self._digests[index]
+
+    def release(self, index: int):
+        """Drop one reference, freeing the string when nothing uses it"""
+        self._refs[index] -= 1
+        if self._refs[index] == 0:
+            self.bytes -= sys.getsizeof(self._values[index])
+            del self._ids[self._digests[index]]
+            self._values[index] = self._digests[index] = None
+            self._free.append(index)
+
+
+class QueuedMessage:
+    """One queued send: interned ids for shared fields, inline strings for the rest"""
+
+    __slots__ = ("shared", "to", "toname", "fromemail", "replyto", "variables")
+
+    def __init__(self, shared: Tuple[int, ...], to: str, toname: str, fromemail: str,
+                 replyto: Optional[str], variables: Optional[str]):
+        # (subject, body, fromname, tag, body_format, api_key) intern ids; for
+        # spilled messages segment offsets of the five strings, then the key id
+        self.shared = shared
+        self.to = to
+        self.toname = toname
+        self.fromemail = fromemail
+        self.replyto = replyto
+        # JSON text: one str instead of a dict per message
+        self.variables = variables
+
+    def size(self) -> int:
+        """Approximate bytes held by this record (shared strings excluded)"""
+        size = sys.getsizeof(self) + _SHARED_SIZE
+        for value in (self.to, self.toname, self.fromemail, self.replyto, self.variables):
+            if value is not None:
+                size += sys.getsizeof(value)
+        return size
+
+    def encode(self) -> bytes:
+        """Segment entry for a spilled message"""
+        parts = [_SPILLED.pack(*self.shared)]
+        for value in (self.to, self.toname, self.fromemail, self.replyto, self.variables):
+            if value is None:
+                parts.append(_LEN.pack(_NONE))
+            else:
+                data = value.encode("utf-8")
+                parts.append(_LEN.pack(len(data)))
+                parts.append(data)
+        body = b"".join(parts)
+        return _LEN.pack(len(body)) + _MESSAGE + body
+
+    @classmethod
+    def decode(cls, buffer, pos: int) -> "QueuedMessage":
+        """Message whose entry body starts at ``pos``"""
+        shared = _SPILLED.unpack_from(buffer, pos)
+        pos += _SPILLED.size
+        values: List[Optional[str]] = []
+        for _ in INLINE_FIELDS:
+            (size,) = _LEN.unpack_from(buffer, pos)
+            pos += _LEN.size
+            if size == _NONE:
+                values.append(None)
+            else:
+                values.append(bytes(buffer[pos:pos + size]).decode("utf-8"))
+                pos += size
+        return cls(shared, *values)
+
+
+_SHARED_SIZE = sys.getsizeof(tuple(range(len(SHARED_FIELDS) + 1)))
+
+
+class Segment:
+    """Append-only spill file, read back through mmap once sealed
+
+    Entries are length-prefixed strings (``S`` + digest + UTF-8) and messages
+    (``M``) that point at the strings by offset; a string is written once per
+    segment while it stays among the recently written ones.
+    """
+
+    def __init__(self, directory: str):
+        fd, self.path = tempfile.mkstemp(prefix="backlog-", suffix=".seg", dir=directory)
+        self._writer = os.fdopen(fd, "wb")
+        self._map: Optional[mmap.mmap] = None
+        self._offset = 0
+        self._strings: "OrderedDict[bytes, int]" = OrderedDict()
+        self.size = 0
+        self.count = 0
+
+    @property
+    def sealed(self) -> bool:
+        return self._writer is None
+
+    def add_string(self, value: str) -> int:
+        """Offset of ``value`` in this segment, writing it if not recently written"""
+        data = value.encode("utf-8")
+        digest = digest_of(data)
+        offset = self._strings.get(digest)
+        if offset is not None:
+            self._strings.move_to_end(digest)
+            return offset
+        offset = self.size
+        self._writer.write(_LEN.pack(_DIGEST_SIZE + len(data)) + _STRING + digest + data)
+        self.size += _LEN.size + 1 + _DIGEST_SIZE + len(data)
+        self._strings[digest] = offset
+        if len(self._strings) > RECENT_STRINGS:
+            self._strings.popitem(last=False)
+        return offset
+
+    def append(self, record: bytes):
+        self._writer.write(record)
+        self.size += len(record)
+        self.count += 1
+
+    def seal(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            self._strings.clear()
+
+    def string(self, offset: int) -> Tuple[bytes, str]:
+        """(digest, value) of the string entry at ``offset``"""
+        (length,) = _LEN.unpack_from(self._map, offset)
+        start = offset + _LEN.size + 1
+        digest = bytes(self._map[start:start + _DIGEST_SIZE])
+        return digest, bytes(self._map[start + _DIGEST_SIZE:start + length]).decode("utf-8")
+
+    def read(self) -> Optional[QueuedMessage]:
+        """Next unread record, or None when the segment is exhausted"""
+        self.seal()
+        while self._offset < self.size:
+            if self._map is None:
+                with open(self.path, "rb") as f:
+                    self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            (length,) = _LEN.unpack_from(self._map, self._offset)
+            start = self._offset + _LEN.size + 1
+            kind = self._map[start - 1:start]
+            self._offset = start + length
+            if kind == _MESSAGE:
+                self.count -= 1
+                return QueuedMessage.decode(self._map, start)
+        return None
+
+    def remove(self):
+        self.seal()
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class CompactBacklog:
+    """FIFO of queued sends with interned shared fields and spill-to-disk"""
+
+    def __init__(self, memory_budget: int = 64 * 1024 * 1024, spill_dir: Optional[str] = None,
+                 segment_bytes: int = 64 * 1024 * 1024):
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir or tempfile.gettempdir()
+        self.segment_bytes = segment_bytes
+        self.pool = InternPool()
+        self._memory: Deque[QueuedMessage] = deque()
+        self._memory_bytes = 0
+        self._segments: Deque[Segment] = deque()
+        self.spilled = 0
+
+    @classmethod
+    def from_env(cls) -> "CompactBacklog":
+        return cls(
+            memory_budget=int(os.getenv("LEMON_EMAIL_BACKLOG_MEMORY_MB", "64")) * 1024 * 1024,
+            spill_dir=os.getenv("LEMON_EMAIL_BACKLOG_SPILL_DIR"),
+        )
+
+    def __len__(self) -> int:
+        return len(self._memory) + sum(segment.count for segment in self._segments)
+
+    def push(self, payload: Dict[str, Any], api_key: str):
+        """Queue a send_email payload for ``api_key``"""
+        pool = self.pool
+        variables = payload.get("variables")
+        message = QueuedMessage(
+            (),
+            payload["to"],
+            payload.get("toname") or "",
+            payload.get("fromemail") or "",
+            payload.get("replyto"),
+            json.dumps(variables, separators=(",", ":")) if variables else None,
+        )
+
+        # Once anything is on disk everything newer goes there too, keeping FIFO order
+        if not self._segments:
+            size = message.size()
+            message.shared = tuple(pool.intern(payload.get(field) or "") for field in SHARED_FIELDS) + (pool.intern(api_key),)
+            if self._memory_bytes + size + pool.bytes <= self.memory_budget:
+                self._memory.append(message)
+                self._memory_bytes += size
+                return
+            for index in message.shared:
+                pool.release(index)
+        self._spill(message, payload, api_key)
+
+    def _spill(self, message: QueuedMessage, payload: Dict[str, Any], api_key: str):
+        tail = self._segments[-1] if self._segments else None
+        if tail is None or tail.sealed or tail.size >= self.segment_bytes:
+            if tail is not None:
+                tail.seal()
+            tail = Segment(self.spill_dir)
+            self._segments.append(tail)
+        # Shared strings go to disk with the message; only the API key stays interned
+        offsets = tuple(tail.add_string(payload.get(field) or "") for field in SHARED_FIELDS)
+        message.shared = offsets + (self.pool.intern(api_key),)
+        tail.append(message.encode())
+        self.spilled += 1
+
+    def _pop_message(self) -> Optional[Tuple[QueuedMessage, List[Tuple[bytes, str]], str]]:
+        """Oldest message, its shared (digest, value) pairs and API key; frees its interned strings"""
+        pool = self.pool
+        if self._memory:
+            message = self._memory.popleft()
+            self._memory_bytes -= message.size()
+            shared = [(pool.digest(index), pool.get(index)) for index in message.shared[:-1]]
+            api_key = pool.get(message.shared[-1])
+            for index in message.shared:
+                pool.release(index)
+            return message, shared, api_key
+        while self._segments:
+            segment = self._segments[0]
+            message = segment.read()
+            if message is not None:
+                shared = [segment.string(offset) for offset in message.shared[:-1]]
+                api_key = pool.get(message.shared[-1])
+                pool.release(message.shared[-1])
+                return message, shared, api_key
+            self._segments.popleft().remove()
+        return None
+
+    def pop(self) -> Optional[Tuple[Dict[str, Any], str]]:
+        """Oldest queued (payload, api_key), or None when empty"""
+        popped = self._pop_message()
+        if popped is None:
+            return None
+        message, shared, api_key = popped
+        subject, body, fromname, tag, body_format = (value for _, value in shared)
+        payload = {
+            "to": message.to,
+            "subject": subject,
+            "body": body,
+            "fromname": fromname,
+            "fromemail": message.fromemail,
+            "toname": message.toname,
+            "tag": tag,
+            "variables": json.loads(message.variables) if message.variables else None,
+            "replyto": message.replyto,
+            "body_format": body_format or None,
+        }
+        return payload, api_key
+
+    def drain_records(self, hash_key: Callable[[str], str]) -> Iterator[Dict[str, Any]]:
+        """Empty the backlog as a stream of compact pending records
+
+        A shared string is yielded as ``{"shared": ref, "value": text}``
+        before the first message that uses it (and again if it recurs after
+        dropping out of the recently emitted ones); messages carry
+        ``<field>_ref`` pointers instead of copies, and the API key only as
+        ``api_key_sha256``. Memory stays flat however long the backlog is.
+        """
+        emitted: "OrderedDict[bytes, str]" = OrderedDict()
+        key_hashes: Dict[str, str] = {}
+        while True:
+            popped = self._pop_message()
+            if popped is None:
+                return
+            message, shared, api_key = popped
+            record: Dict[str, Any] = {
+                "to": message.to,
+                "toname": message.toname,
+                "fromemail": message.fromemail,
+                "replyto": message.replyto,
+                "variables": json.loads(message.variables) if message.variables else None,
+            }
+            for field, (digest, value) in zip(SHARED_FIELDS, shared):
+                ref = emitted.get(digest)
+                if ref is not None:
+                    emitted.move_to_end(digest)
+                else:
+                    ref = emitted[digest] = digest.hex()
+                    if len(emitted) > RECENT_STRINGS:
+                        emitted.popitem(last=False)
+                    yield {"shared": ref, "value": value}
+                record[f"{field}_ref"] = ref
+            if api_key not in key_hashes:
+                key_hashes[api_key] = hash_key(api_key)
+            record["api_key_sha256"] = key_hashes[api_key]
+            yield record
+
+    def clear(self):
+        self._memory.clear()
+        self._memory_bytes = 0
+        while self._segments:
+            self._segments.popleft().remove()
+        self.pool = InternPool()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": len(self),
+            "in_memory": len(self._memory),
+            "on_disk": len(self) - len(self._memory),
+            "segments": len(self._segments),
+            "memory_bytes": self._memory_bytes + self.pool.bytes,
+            "memory_budget": self.memory_budget,
+            "interned_strings": len(self.pool),
+        }
@@ -0,0 +1,515 @@
+#!/usr/bin/env python3
+"""
+Local benchmarks for the Lemon Email MCP server
+Everything runs against in-process stubs, no API key or network needed
+"""
+
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+from attachments import AttachmentSource, request_body
+from backlog import CompactBacklog
+from body_rendering import BodyRenderer
+from fair_scheduler import FairScheduler
+from json_codec import CODECS, codec
+from payload_validation import VALIDATORS, SendEmailRequest
+import profiling
+import runtime_mode
+from upstream_pool import UpstreamPool
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """p50/p95/p99 in milliseconds"""
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99)}
+
+
+def print_row(label: str, stats: Dict[str, float]):
+    print(f"   {label:<28} " + "  ".join(f"{k}={v:8.2f}ms" for k, v in stats.items()))
+
+
+class StubResponse:
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+
+
+class StubEndpoint:
+    """Simulated regional endpoint: base latency, a slow tail and an error rate"""
+
+    def __init__(self, latency: float, tail_latency: float, tail_rate: float, error_rate: float = 0.0):
+        self.latency = latency
+        self.tail_latency = tail_latency
+        self.tail_rate = tail_rate
+        self.error_rate = error_rate
+
+    async def __call__(self) -> StubResponse:
+        slow = random.random() < self.tail_rate
+        await asyncio.sleep(self.tail_latency if slow else self.latency * random.uniform(0.8, 1.2))
+        if random.random() < self.error_rate:
+            raise ConnectionError("stub endpoint refused connection")
+        return StubResponse(200)
+
+
+async def bench_failover(requests: int = 2000, concurrency: int = 50):
+    """Tail latency: single endpoint vs latency-aware pool vs pool with hedging"""
+    print("🌐 Upstream failover / hedging")
+    print("-" * 30)
+    stubs = {
+        "https://eu.stub/api": StubEndpoint(0.010, 0.250, 0.05, error_rate=0.02),
+        "https://us.stub/api": StubEndpoint(0.012, 0.250, 0.05),
+        "https://slow.stub/api": StubEndpoint(0.060, 0.300, 0.05),
+    }
+
+    failures = [0]
+
+    async def run(pool: UpstreamPool, idempotent: bool) -> List[float]:
+        failures[0] = 0
+        latencies: List[float] = []
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def send(base_url: str):
+            return await stubs[base_url]()
+
+        async def one():
+            async with semaphore:
+                start = time.monotonic()
+                try:
+                    await pool.request(send, idempotent=idempotent)
+                except ConnectionError:
+                    failures[0] += 1
+                latencies.append(time.monotonic() - start)
+
+        await asyncio.gather(*(one() for _ in range(requests)))
+        return latencies
+
+    urls = list(stubs)
+    runs = [
+        ("single endpoint", UpstreamPool(urls[:1]), False),
+        ("pool, failover", UpstreamPool(urls, retryable=(ConnectionError,)), False),
+        ("pool, failover + hedging", UpstreamPool(urls, hedge=True), True),
+    ]
+    for label, pool, idempotent in runs:
+        print_row(label, percentiles(await run(pool, idempotent)))
+        print(f"   {'':<28} failed sends: {failures[0]}")
+
+
+def sample_payload(i: int) -> Dict:
+    return {
+        "fromname": "Email Assistant",
+        "fromemail": "mail@normanszobotka.com",
+        "to": f"user{i}@example.com",
+        "toname": "",
+        "subject": "Your weekly summary is ready 📬",
+        "body": "Hello!\n\n" + "Here is what happened this week. " * 40,
+        "tag": "mcp-agent",
+        "variables": {"name": f"User {i}", "plan": "pro"},
+        "replyto": "mail@normanszobotka.com",
+    }
+
+
+async def bench_codec(iterations: int = 20000):
+    """Per-send CPU cost of building and encoding the request and parsing the reply"""
+    print("🧮 Request scaffolding + JSON codec")
+    print("-" * 30)
+    api_key = "k" * 32
+    base_url = "https://app.xn--lemn-sqa.com/api"
+    reply = b'{"success":true,"message":"queued","id":"0b6f8c1e2d"}'
+    payloads = [sample_payload(i) for i in range(100)]
+
+    def legacy(payload):
+        # What each send used to do: fresh headers, formatted URL, httpx's json=
+        # encoding (stdlib dumps + encode); the reply parsed as response.json() does
+        headers = {"Content-Type": "application/json", "X-Auth-APIKey": api_key}
+        url = f"{base_url}/transactional/send"
+        content = json.dumps(payload).encode("utf-8")
+        return headers, url, content, json.loads(reply)
+
+    headers = {"Content-Type": "application/json", "X-Auth-APIKey": api_key}
+    send_urls = {base_url: f"{base_url}/transactional/send"}
+
+    def precomputed(codec):
+        def send(payload):
+            return headers, send_urls[base_url], codec.dumps(payload), codec.parse_body(reply)
+        return send
+
+    variants = [("legacy (stdlib, per-send)", legacy)]
+    variants += [(f"precomputed + {name}", precomputed(codec)) for name, codec in CODECS.items()]
+    for label, fn in variants:
+        start = time.perf_counter()
+        for i in range(iterations):
+            fn(payloads[i % 100])
+        per_send = (time.perf_counter() - start) / iterations * 1e6
+        print(f"   {label:<28} {per_send:8.2f}µs/send")
+
+
+async def loop_workload(tasks: int = 50000) -> float:
+    """Task churn plus queue hand-offs, roughly what request handling does to a loop"""
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def producer(n):
+        for i in range(n):
+            await queue.put(i)
+            await asyncio.sleep(0)
+
+    async def consumer(n):
+        for _ in range(n):
+            await queue.get()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(producer(tasks // 100) for _ in range(100)), consumer(tasks))
+    await asyncio.gather(*(asyncio.sleep(0) for _ in range(tasks)))
+    return time.perf_counter() - start
+
+
+async def load_test_web(performance: bool, port: int, requests: int = 5000, concurrency: int = 100):
+    """Start web_server.py in the given mode and hammer GET /health"""
+    import httpx
+
+    args = [sys.executable, "web_server.py"] + ([runtime_mode.PERFORMANCE_FLAG] if performance else [])
+    process = subprocess.Popen(
+        args,
+        env={**os.environ, "PORT": str(port)},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}/health"
+    try:
+        async with httpx.AsyncClient(limits=httpx.Limits(max_connections=concurrency)) as client:
+            for _ in range(100):
+                try:
+                    await client.get(url)
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+
+            latencies: List[float] = []
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def one():
+                async with semaphore:
+                    t0 = time.monotonic()
+                    await client.get(url)
+                    latencies.append(time.monotonic() - t0)
+
+            start = time.monotonic()
+            await asyncio.gather(*(one() for _ in range(requests)))
+            return requests / (time.monotonic() - start), percentiles(latencies)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+async def bench_runtime():
+    """Default vs performance runtime: raw loop throughput and HTTP load"""
+    print("⚙️  Runtime modes")
+    print("-" * 30)
+    loops = [("asyncio", asyncio.new_event_loop)]
+    if runtime_mode.UVLOOP_AVAILABLE:
+        loops.append(("uvloop", runtime_mode.uvloop.new_event_loop))
+    else:
+        print("   uvloop not installed - performance mode falls back to asyncio")
+    def run_on(factory):
+        loop = factory()
+        try:
+            return loop.run_until_complete(loop_workload())
+        finally:
+            loop.close()
+
+    for label, factory in loops:
+        # Each loop runs in its own thread so the benchmark's own loop is untouched
+        elapsed = await asyncio.to_thread(run_on, factory)
+        print(f"   {label + ' loop workload':<28} {elapsed * 1000:8.1f}ms")
+
+    try:
+        import httpx  # noqa: F401
+        import uvicorn  # noqa: F401
+    except ImportError:
+        print("   httpx/uvicorn not installed - skipping HTTP load test")
+        return
+    for label, performance, port in (("default mode", False, 8765), ("performance mode", True, 8766)):
+        rps, stats = await load_test_web(performance, port)
+        print_row(f"{label} {rps:7.0f} req/s", stats)
+
+
+async def bench_fairness(burst: int = 4000, small_tenants: int = 5, duration: float = 3.0):
+    """Small tenants' latency while one tenant bursts: FIFO vs deficit round-robin"""
+    print("⚖️  Tenant fairness under a burst")
+    print("-" * 30)
+    upstream_latency = 0.02
+
+    async def send():
+        await asyncio.sleep(upstream_latency * random.uniform(0.8, 1.2))
+        return {"success": True}
+
+    async def run(fair: bool) -> List[float]:
+        # FIFO is the same scheduler with every request in one shared queue
+        scheduler = FairScheduler(concurrency=16, max_queue_per_tenant=burst)
+        tenant = (lambda name: name) if fair else (lambda name: "everyone")
+        latencies: List[float] = []
+
+        async def timed(name):
+            start = time.monotonic()
+            await scheduler.submit(tenant(name), send)
+            return time.monotonic() - start
+
+        async def small(name):
+            end = time.monotonic() + duration
+            while time.monotonic() < end:
+                latencies.append(await timed(name))
+                await asyncio.sleep(0.05)
+
+        big = [asyncio.ensure_future(scheduler.submit(tenant("big"), send)) for _ in range(burst)]
+        await asyncio.gather(*(small(f"small-{i}") for i in range(small_tenants)))
+        for task in big:
+            task.cancel()
+        scheduler.close()
+        await asyncio.gather(*big, return_exceptions=True)
+        return latencies
+
+    print_row("FIFO (single queue)", percentiles(await run(False)))
+    print_row("deficit round-robin", percentiles(await run(True)))
+
+
+def campaign_message(i: int) -> Dict:
+    # Per-message fields vary, the campaign content is shared; each message
+    # gets its own copies like a freshly parsed JSON request would
+    body = "".join(["Hello!\n\n", "Our spring campaign starts today. " * 60])
+    return {
+        "to": f"user{i}@example.com",
+        "subject": "".join(["Spring ", "sale 🌷"]),
+        "body": body,
+        "fromname": "".join(["Lemon ", "Shop"]),
+        "fromemail": "mail@normanszobotka.com",
+        "toname": f"User {i}",
+        "tag": "".join(["spring-", "campaign"]),
+        "variables": {"coupon": f"C{i:07d}"},
+        "replyto": None,
+    }
+
+
+async def bench_backlog(messages: int = 100_000, large: int = 1_000_000):
+    """Python heap used by a queued campaign: list of dicts vs compact backlog"""
+    print("🗃️  Campaign backlog memory")
+    print("-" * 30)
+
+    def measure(build) -> float:
+        tracemalloc.start()
+        keep = build()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del keep
+        return peak / (1024 * 1024)
+
+    def as_dicts():
+        return [campaign_message(i) for i in range(messages)]
+
+    with tempfile.TemporaryDirectory() as spill_dir:
+        def as_backlog():
+            backlog = CompactBacklog(memory_budget=8 * 1024 * 1024, spill_dir=spill_dir)
+            for i in range(messages):
+                backlog.push(campaign_message(i), "campaign-api-key")
+            return backlog
+
+        print(f"   {messages:,} messages as payload dicts       {measure(as_dicts):8.1f} MiB")
+        print(f"   {messages:,} messages in CompactBacklog      {measure(as_backlog):8.1f} MiB (8 MiB budget)")
+
+        backlog = CompactBacklog(memory_budget=8 * 1024 * 1024, spill_dir=spill_dir)
+        start = time.perf_counter()
+        for i in range(large):
+            backlog.push(campaign_message(i), "campaign-api-key")
+        pushed = time.perf_counter() - start
+        stats = backlog.stats()
+        start = time.perf_counter()
+        while backlog.pop() is not None:
+            pass
+        popped = time.perf_counter() - start
+        print(f"   {large:,} messages: push {large / pushed:,.0f}/s, pop {large / popped:,.0f}/s, "
+              f"{stats['on_disk']:,} spilled over {stats['segments']} segment(s)")
+
+
+async def bench_attachments(megabytes: int = 20):
+    """Peak Python heap building a send with one large attachment: whole vs streamed"""
+    print("📎 Attachment request body")
+    print("-" * 30)
+    payload = sample_payload(0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "report.pdf")
+        with open(path, "wb") as f:
+            for _ in range(megabytes):
+                f.write(os.urandom(1024 * 1024))
+
+        def whole() -> int:
+            import base64
+            with open(path, "rb") as f:
+                content = base64.b64encode(f.read()).decode("ascii")
+            attachment = {"filename": "report.pdf", "contentType": "application/pdf", "content": content}
+            return len(codec.dumps({**payload, "attachments": [attachment]}))
+
+        async def streamed(gzip: bool) -> int:
+            body = request_body(codec.dumps(payload), [AttachmentSource.from_path(path, root=directory)], codec.dumps, gzip=gzip)
+            # Stand-in for the socket: count bytes and drop them
+            size = 0
+            async for chunk in body():
+                size += len(chunk)
+            return size
+
+        async def measure(label: str, build):
+            tracemalloc.start()
+            start = time.perf_counter()
+            size = build()
+            if asyncio.iscoroutine(size):
+                size = await size
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"   {label:<24} peak {peak / (1024 * 1024):7.2f} MiB   "
+                  f"{size / (1024 * 1024):6.1f} MiB body in {elapsed * 1000:6.0f}ms")
+
+        print(f"   {megabytes} MiB attachment")
+        await measure("read + encode whole", whole)
+        await measure("streamed", lambda: streamed(False))
+        await measure("streamed + gzip", lambda: streamed(True))
+
+
+async def bench_validation(messages: int = 10_000):
+    """Per-message cost of validating send payloads: model per request vs shared validator"""
+    print("✅ Payload validation")
+    print("-" * 30)
+    from pydantic import BaseModel
+
+    class EmailRequest(BaseModel):
+        # The per-request model /send-email used to build
+        to: str
+        subject: str
+        body: str
+        fromname: str = "Email Assistant"
+        fromemail: str
+        toname: str = ""
+        tag: str = "web-api"
+        variables: Optional[Dict] = None
+        replyto: Optional[str] = None
+        api_key: str
+
+    batch = [{**sample_payload(i), "api_key": "k" * 32} for i in range(messages)]
+    batch[::100] = [{"to": "", "subject": "missing fields"}] * len(batch[::100])
+
+    def model_per_message():
+        for item in batch:
+            try:
+                EmailRequest(**item).model_dump(exclude={"api_key"})
+            except Exception:
+                pass
+
+    def report(label: str, fn, rounds: int = 5):
+        best = float("inf")
+        for _ in range(rounds):
+            start = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - start)
+        per_message = best / messages * 1e6
+        print(f"   {label:<34} {per_message:6.2f}µs/message")
+
+    print(f"   {messages:,} messages, 1% invalid (best of 5)")
+    report("BaseModel per message", model_per_message)
+    for name, validator in VALIDATORS.items():
+        def one_by_one(validator=validator):
+            for item in batch:
+                try:
+                    validator.validate(item, SendEmailRequest)
+                except ValueError:
+                    pass
+        report(f"{name}: one at a time", one_by_one)
+        report(f"{name}: whole batch", lambda validator=validator: validator.validate_many(batch, SendEmailRequest))
+
+
+def markdown_body(i: int) -> str:
+    section = (
+        "## Highlights\n\n"
+        "This week **{i} orders** shipped and _most_ arrived early. See the "
+        "[dashboard](https://example.com/d/{i}) or run `report --week`.\n\n"
+        "- Faster checkout\n- New *spring* catalogue\n- Fewer `5xx` errors\n\n"
+        "> Thanks for being a customer!\n\n"
+    )
+    return f"# Weekly report {i}\n\n" + section.format(i=i) * 40
+
+
+async def bench_rendering(bodies: int = 200, campaign: int = 2000):
+    """Event-loop lag while 32 concurrent sends render Markdown bodies: inline vs process pool"""
+    print("🖋️  Body rendering vs event-loop lag")
+    print("-" * 30)
+    distinct = [markdown_body(i) for i in range(bodies)]
+
+    async def run(label: str, renderer: BodyRenderer, texts: List[str]):
+        monitor = profiling.LoopMonitor(interval=0.005, slow_threshold=60.0)
+        monitor.start()
+        await asyncio.sleep(0.05)
+        pending = iter(texts)
+
+        async def sender():
+            # Like the scheduler: a bounded number of sends in flight at once
+            for text in pending:
+                await renderer.render(text, "markdown")
+                await asyncio.sleep(0)  # the upstream call would yield here
+
+        start = time.perf_counter()
+        await asyncio.gather(*(sender() for _ in range(32)))
+        elapsed = time.perf_counter() - start
+        await asyncio.sleep(0.05)
+        await monitor.stop()
+        stats = monitor.stats()
+        print(f"   {label:<30} {elapsed * 1000:7.0f}ms   loop lag p99 {stats['lag_p99_ms']:7.2f}ms, "
+              f"max {stats['lag_max_ms']:7.2f}ms   ({renderer.misses} rendered)")
+
+    workers = max(2, min(4, os.cpu_count() or 1))
+    pool, campaign_pool = BodyRenderer(workers=workers), BodyRenderer(workers=workers)
+    await pool.start()
+    await campaign_pool.start()
+
+    print(f"   {bodies} distinct Markdown bodies, ~{len(distinct[0]) // 1024} KiB each")
+    await run("inline on the event loop", BodyRenderer(workers=0), distinct)
+    await run(f"process pool ({workers} workers)", pool, distinct)
+    print(f"   campaign: {campaign:,} sends sharing one body")
+    await run("process pool + hash cache", campaign_pool, [distinct[0]] * campaign)
+    pool.shutdown()
+    campaign_pool.shutdown()
+
+
+SCENARIOS = {
+    "failover": bench_failover,
+    "codec": bench_codec,
+    "runtime": bench_runtime,
+    "fairness": bench_fairness,
+    "backlog": bench_backlog,
+    "attachments": bench_attachments,
+    "validation": bench_validation,
+    "rendering": bench_rendering,
+}
+
+
+async def main():
+    """Run the named scenarios, or all of them"""
+    names = sys.argv[1:] or list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        print(f"❌ Unknown scenario(s): {', '.join(unknown)}")
+        print(f"   Available: {', '.join(SCENARIOS)}")
+        return
+
+    print("🍋 LEMON EMAIL MCP - BENCHMARKS")
+    print("=" * 60)
+    for name in names:
+        await SCENARIOS[name]()
+        print()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Email body rendering off the event loop
+Plain text or Markdown is turned into sanitized HTML with inlined CSS plus a
+plain-text alternative. Rendering runs in a process pool and results are
+cached by content hash, so a campaign's shared body is rendered once
+"""
+
+import asyncio
+import hashlib
+import html
+import multiprocessing
+import os
+import re
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+
+BODY_FORMATS = ("html", "plain", "markdown")
+# Payload field for the plain-text alternative of rendered bodies; off unless the
+# operator names a field the API actually accepts
+TEXT_BODY_FIELD = os.getenv("LEMON_EMAIL_TEXT_BODY_FIELD", "")
+
+# Inlined because many mail clients drop <style> blocks
+FONT = "font-family:-apple-system,Segoe UI,Helvetica,Arial,sans-serif;font-size:15px;line-height:1.5;color:#222"
+STYLES = {
+    "div": FONT,
+    "p": "margin:0 0 14px",
+    "h1": "margin:0 0 14px;font-size:24px;line-height:1.3",
+    "h2": "margin:0 0 12px;font-size:20px;line-height:1.3",
+    "h3": "margin:0 0 10px;font-size:17px;line-height:1.3",
+    "ul": "margin:0 0 14px;padding-left:24px",
+    "ol": "margin:0 0 14px;padding-left:24px",
+    "li": "margin:0 0 4px",
+    "blockquote": "margin:0 0 14px;padding:0 0 0 12px;border-left:3px solid #ddd;color:#555",
+    "pre": "margin:0 0 14px;padding:10px;background:#f5f5f5;border-radius:4px;overflow:auto",
+    "code": "font-family:Menlo,Consolas,monospace;font-size:13px;background:#f5f5f5",
+    "a": "color:#1a73e8",
+    "hr": "border:0;border-top:1px solid #ddd;margin:18px 0",
+}
+
+# Only these URL schemes become links; anything else stays text
+SAFE_URL = re.compile(r"^(?:https?://|mailto:)", re.IGNORECASE)
+BARE_URL = re.compile(r"\bhttps?://[^\s<>\"']+[^\s<>\"'.,;:!?)]")
+MD_LINK = re.compile(r"\[([^\]\n]+)\]\(([^)\s]+)\)")
+MD_CODE = re.compile(r"`([^`\n]+)`")
+MD_STRONG = re.compile(r"\*\*(?=\S)(.+?)(?<=\S)\*\*|__(?=\S)(.+?)(?<=\S)__")
+MD_EM = re.compile(r"(?<![\w*])\*(?=\S)(.+?)(?<=\S)\*(?!\*)|(?<!\w)_(?=\S)(.+?)(?<=\S)_(?!\w)")
+
+HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+BULLET = re.compile(r"^\s*[-*+]\s+(.*)$")
+NUMBERED = re.compile(r"^\s*\d+[.)]\s+(.*)$")
+RULE = re.compile(r"^\s*(?:(?:\*\s*){3,}|(?:-\s*){3,}|(?:_\s*){3,})$")
+FENCE = re.compile(r"^\s*(```|~~~)")
+
+Block = Tuple[str, object]
+
+
+def tag(name: str, content: str) -> str:
+    return f'<{name} style="{STYLES[name]}">{content}</{name}>'
+
+
+def parse_markdown(text: str) -> List[Block]:
+    """Markdown subset as (kind, data) blocks: headings, paragraphs, lists,
+    blockquotes, fenced code and rules"""
+    blocks: List[Block] = []
+    lines = text.replace("\r\n", "\n").split("\n")
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if not line.strip():
+            i += 1
+            continue
+
+        fence = FENCE.match(line)
+        if fence:
+            code = []
+            i += 1
+            while i < len(lines) and not lines[i].strip().startswith(fence.group(1)):
+                code.append(lines[i])
+                i += 1
+            blocks.append(("code", "\n".join(code)))
+            i += 1
+            continue
+
+        heading = HEADING.match(line)
+        if heading:
+            blocks.append((f"h{min(len(heading.group(1)), 3)}", heading.group(2)))
+            i += 1
+            continue
+
+        if RULE.match(line):
+            blocks.append(("hr", None))
+            i += 1
+            continue
+
+        if line.lstrip().startswith(">"):
+            quoted = []
+            while i < len(lines) and lines[i].lstrip().startswith(">"):
+                quoted.append(lines[i].lstrip()[1:].removeprefix(" "))
+                i += 1
+            blocks.append(("blockquote", parse_markdown("\n".join(quoted))))
+            continue
+
+        for kind, pattern in (("ul", BULLET), ("ol", NUMBERED)):
+            if pattern.match(line):
+                items = []
+                while i < len(lines) and pattern.match(lines[i]):
+                    items.append(pattern.match(lines[i]).group(1))
+                    i += 1
+                blocks.append((kind, items))
+                break
+        else:
+            paragraph = []
+            while (i < len(lines) and lines[i].strip() and not FENCE.match(lines[i])
+                   and not HEADING.match(lines[i]) and not RULE.match(lines[i]) and not lines[i].lstrip().startswith(">")
+                   and not BULLET.match(lines[i]) and not NUMBERED.match(lines[i])):
+                paragraph.append(lines[i].strip())
+                i += 1
+            blocks.append(("p", paragraph))
+    return blocks
+
+
+def emphasis(text: str, strong: str = "<strong>{}</strong>", em: str = "<em>{}</em>") -> str:
+    text = MD_STRONG.sub(lambda m: strong.format(m.group(1) or m.group(2)), text)
+    return MD_EM.sub(lambda m: em.format(m.group(1) or m.group(2)), text)
+
+
+PLACEHOLDER = re.compile(r"\x00(\d+)\x00")
+
+
+def restore(text: str, kept: List[str]) -> str:
+    # Recursive: a kept link's label can itself hold a code placeholder
+    return PLACEHOLDER.sub(lambda m: restore(kept[int(m.group(1))], kept), text)
+
+
+def inline_html(text: str) -> str:
+    """Escape, then apply code spans, safe links, bold and italics"""
+    # Code spans and finished links are swapped for placeholders so emphasis
+    # never rewrites their contents (e.g. underscores or ** inside a URL)
+    kept: List[str] = []
+
+    def keep(fragment: str) -> str:
+        kept.append(fragment)
+        return f"\x00{len(kept) - 1}\x00"
+
+    text = html.escape(MD_CODE.sub(lambda m: keep(tag("code", html.escape(m.group(1)))), text.replace("\x00", "")))
+
+    def link(match):
+        label, url = emphasis(match.group(1)), html.unescape(match.group(2))
+        if not SAFE_URL.match(url):
+            return label
+        return keep(f'<a href="{html.escape(url)}" style="{STYLES["a"]}">{label}</a>')
+
+    return restore(emphasis(MD_LINK.sub(link, text)), kept)
+
+
+def inline_text(text: str) -> str:
+    """Markdown inline markup reduced to readable plain text"""
+    kept: List[str] = []
+
+    def keep(fragment: str) -> str:
+        kept.append(fragment)
+        return f"\x00{len(kept) - 1}\x00"
+
+    text = MD_CODE.sub(lambda m: keep(m.group(1)), text.replace("\x00", ""))
+
+    def link(match):
+        label, url = match.group(1), match.group(2)
+        return keep(emphasis(label, "{}", "{}") if label == url else f"{emphasis(label, '{}', '{}')} ({url})")
+
+    return restore(emphasis(MD_LINK.sub(link, text), "{}", "{}"), kept)
+
+
+def blocks_html(blocks: List[Block]) -> str:
+    parts = []
+    for kind, data in blocks:
+        if kind == "p":
+            parts.append(tag("p", "<br>".join(inline_html(line) for line in data)))
+        elif kind in ("h1", "h2", "h3"):
+            parts.append(tag(kind, inline_html(data)))
+        elif kind in ("ul", "ol"):
+            parts.append(tag(kind, "".join(tag("li", inline_html(item)) for item in data)))
+        elif kind == "blockquote":
+            parts.append(tag("blockquote", blocks_html(data)))
+        elif kind == "code":
+            parts.append(f'<pre style="{STYLES["pre"]}"><code style="{STYLES["code"]}">{html.escape(data)}</code></pre>')
+        elif kind == "hr":
+            parts.append(f'<hr style="{STYLES["hr"]}">')
+    return "".join(parts)
+
+
+def blocks_text(blocks: List[Block]) -> str:
+    parts = []
+    for kind, data in blocks:
+        if kind == "p":
+            parts.append("\n".join(inline_text(line) for line in data))
+        elif kind in ("h1", "h2", "h3"):
+            parts.append(inline_text(data))
+        elif kind == "ul":
+            parts.append("\n".join(f"- {inline_text(item)}" for item in data))
+        elif kind == "ol":
+            parts.append("\n".join(f"{n}. {inline_text(item)}" for n, item in enumerate(data, 1)))
+        elif kind == "blockquote":
+            parts.append("\n".join(f"> {line}" for line in blocks_text(data).split("\n")))
+        elif kind == "code":
+            parts.append(data)
+        elif kind == "hr":
+            parts.append("-" * 20)
+    return "\n\n".join(parts)
+
+
+def plain_html(text: str) -> str:
+    """Plain text as escaped paragraphs, line breaks kept and bare URLs linked"""
+    def paragraph(chunk: str) -> str:
+        escaped = html.escape(chunk.strip("\n"))
+        linked = BARE_URL.sub(lambda m: f'<a href="{m.group(0)}" style="{STYLES["a"]}">{m.group(0)}</a>', escaped)
+        return tag("p", linked.replace("\n", "<br>"))
+
+    chunks = re.split(r"\n\s*\n", text.replace("\r\n", "\n"))
+    return "".join(paragraph(chunk) for chunk in chunks if chunk.strip())
+
+
+def render_body(body: str, body_format: str) -> Dict[str, str]:
+    """``{"html", "text"}`` for a plain or Markdown body (runs in worker processes)"""
+    if body_format == "markdown":
+        blocks = parse_markdown(body)
+        return {"html": tag("div", blocks_html(blocks)), "text": blocks_text(blocks)}
+    if body_format == "plain":
+        return {"html": tag("div", plain_html(body)), "text": body}
+    raise ValueError(f"Unknown body format: {body_format} (expected one of {', '.join(BODY_FORMATS)})")
+
+
+class BodyRenderer:
+    """Process-pool renderer with a content-hash LRU and in-flight dedupe"""
+
+    def __init__(self, workers: int = 2, cache_size: int = 1024):
+        # 0 workers renders on the calling thread (no multiprocessing available)
+        self.workers = workers
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[bytes, Dict[str, str]]" = OrderedDict()
+        self._in_flight: Dict[bytes, "asyncio.Future"] = {}
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls) -> "BodyRenderer":
+        return cls(
+            workers=int(os.getenv("LEMON_EMAIL_RENDER_WORKERS", str(min(2, os.cpu_count() or 1)))),
+            cache_size=int(os.getenv("LEMON_EMAIL_RENDER_CACHE_SIZE", "1024")),
+        )
+
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: forking a process that runs threads (to_thread, watchdogs) is unsafe
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    async def start(self):
+        """Spawn the workers from a thread, so the first render doesn't stall the loop"""
+        if self.workers > 0:
+            executor = self.executor()
+            await asyncio.to_thread(lambda: list(executor.map(render_body, [""] * self.workers, ["plain"] * self.workers)))
+
+    async def render(self, body: str, body_format: str) -> Dict[str, str]:
+        """Rendered ``{"html", "text"}``; identical bodies are rendered once"""
+        if body_format not in BODY_FORMATS:
+            raise ValueError(f"Unknown body format: {body_format} (expected one of {', '.join(BODY_FORMATS)})")
+        if body_format == "html":
+            return {"html": body, "text": ""}
+
+        key = hashlib.blake2b(f"{body_format}\x00{body}".encode("utf-8"), digest_size=16).digest()
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return cached
+
+        pending = self._in_flight.get(key)
+        if pending is not None:
+            self.hits += 1
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        if self.workers <= 0:
+            return self._store(key, render_body(body, body_format))
+
+        future = asyncio.get_running_loop().run_in_executor(self.executor(), render_body, body, body_format)
+        self._in_flight[key] = future
+        try:
+            rendered = await asyncio.shield(future)
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool for the next render
+            self._executor = None
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+        return self._store(key, rendered)
+
+    def _store(self, key: bytes, rendered: Dict[str, str]) -> Dict[str, str]:
+        self._cache[key] = rendered
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return rendered
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "workers": self.workers,
+            "cached": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "in_flight": len(self._in_flight),
+        }
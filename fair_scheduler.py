@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Weighted fair scheduling of upstream sends across tenants
+Each tenant (API-key hash) gets its own queue; queues are served with
+deficit round-robin so one tenant's burst cannot starve everyone else
+"""
+
+import asyncio
+import os
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+Job = Callable[[], Awaitable[Any]]
+Starter = Callable[[Awaitable[Any], Any], "asyncio.Future"]
+
+
+class TenantQueueFull(Exception):
+    """Raised when a tenant already has the maximum number of queued sends"""
+
+
+def parse_weights(raw: Optional[str]) -> Dict[str, float]:
+    """``<key-hash-prefix>=<weight>,...`` as used by LEMON_EMAIL_TENANT_WEIGHTS"""
+    weights: Dict[str, float] = {}
+    for item in (raw or "").split(","):
+        if "=" in item:
+            prefix, weight = item.split("=", 1)
+            # A zero weight would never accumulate deficit and spin the ring
+            weights[prefix.strip().lower()] = max(float(weight), 0.01)
+    return weights
+
+
+class TenantQueue:
+    __slots__ = ("tenant", "weight", "deficit", "jobs")
+
+    def __init__(self, tenant: str, weight: float):
+        self.tenant = tenant
+        self.weight = weight
+        self.deficit = 0.0
+        # (job, future, record) triples
+        self.jobs: Deque[Tuple[Job, "asyncio.Future", Any]] = deque()
+
+
+class FairScheduler:
+    """Deficit round-robin over per-tenant queues in front of a concurrency limit"""
+
+    def __init__(
+        self,
+        concurrency: int = 32,
+        weights: Optional[Dict[str, float]] = None,
+        default_weight: float = 1.0,
+        max_queue_per_tenant: int = 1000,
+        starter: Optional[Starter] = None,
+    ):
+        self.concurrency = concurrency
+        self.weights = weights or {}
+        self.default_weight = default_weight
+        self.max_queue_per_tenant = max_queue_per_tenant
+        self.starter = starter or (lambda send, record: asyncio.ensure_future(send))
+        self.running = 0
+        self.closed = False
+        self._tenants: Dict[str, TenantQueue] = {}
+        # Round-robin ring of tenants that have queued work
+        self._ring: Deque[TenantQueue] = deque()
+
+    @classmethod
+    def from_env(cls, starter: Optional[Starter] = None) -> "FairScheduler":
+        return cls(
+            concurrency=int(os.getenv("LEMON_EMAIL_UPSTREAM_CONCURRENCY", "32")),
+            weights=parse_weights(os.getenv("LEMON_EMAIL_TENANT_WEIGHTS")),
+            max_queue_per_tenant=int(os.getenv("LEMON_EMAIL_TENANT_QUEUE_LIMIT", "1000")),
+            starter=starter,
+        )
+
+    def weight_for(self, tenant: str) -> float:
+        """Configured weight of the longest matching key-hash prefix"""
+        best, weight = 0, self.default_weight
+        for prefix, configured in self.weights.items():
+            if len(prefix) > best and tenant.startswith(prefix):
+                best, weight = len(prefix), configured
+        return weight
+
+    @property
+    def queued(self) -> int:
+        return sum(len(tq.jobs) for tq in self._ring)
+
+    def enqueue(self, tenant: str, job: Job, record: Any = None) -> "asyncio.Future":
+        """Queue ``job`` for ``tenant`` and return a future for its result"""
+        if self.closed:
+            raise RuntimeError("Scheduler is closed")
+        tq = self._tenants.get(tenant)
+        if tq is None:
+            tq = self._tenants[tenant] = TenantQueue(tenant, self.weight_for(tenant))
+        if len(tq.jobs) >= self.max_queue_per_tenant:
+            raise TenantQueueFull(f"Too many queued sends for this API key (limit {self.max_queue_per_tenant})")
+
+        future = asyncio.get_running_loop().create_future()
+        if not tq.jobs:
+            self._ring.append(tq)
+        tq.jobs.append((job, future, record))
+        self._dispatch()
+        return future
+
+    async def submit(self, tenant: str, job: Job, record: Any = None) -> Any:
+        """Queue ``job`` for ``tenant`` and wait for its result
+
+        The job keeps its place (and runs) even if the caller is cancelled.
+        """
+        return await asyncio.shield(self.enqueue(tenant, job, record))
+
+    def _next(self) -> Optional[Tuple[Job, "asyncio.Future", Any]]:
+        while self._ring:
+            tq = self._ring[0]
+            if tq.deficit < 1.0:
+                tq.deficit += tq.weight
+                if tq.deficit < 1.0:
+                    self._ring.rotate(-1)
+                    continue
+            item = tq.jobs.popleft()
+            tq.deficit -= 1.0
+            if not tq.jobs:
+                self._ring.popleft()
+                del self._tenants[tq.tenant]
+            elif tq.deficit < 1.0:
+                self._ring.rotate(-1)
+            return item
+        return None
+
+    def _dispatch(self):
+        while not self.closed and self.running < self.concurrency:
+            item = self._next()
+            if item is None:
+                return
+            job, future, record = item
+            self.running += 1
+            try:
+                task = self.starter(job(), record)
+            except BaseException as e:
+                self.running -= 1
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            task.add_done_callback(lambda t, f=future: self._finished(t, f))
+
+    def _finished(self, task: "asyncio.Future", future: "asyncio.Future"):
+        self.running -= 1
+        if not future.done():
+            if task.cancelled():
+                future.cancel()
+            elif task.exception() is not None:
+                future.set_exception(task.exception())
+            else:
+                future.set_result(task.result())
+        self._dispatch()
+
+    def close(self, error: Optional[BaseException] = None) -> List[Any]:
+        """Stop dispatching; fail queued jobs and return their records"""
+        self.closed = True
+        records = []
+        for tq in self._ring:
+            for _, future, record in tq.jobs:
+                if record is not None:
+                    records.append(record)
+                if not future.done():
+                    future.set_exception(error or RuntimeError("Scheduler is closed"))
+                    # Nobody may be awaiting anymore; don't warn about it
+                    future.exception()
+        self._ring.clear()
+        self._tenants.clear()
+        return records
+
+    def stats(self, top: int = 10) -> Dict[str, Any]:
+        busiest = sorted(self._ring, key=lambda tq: len(tq.jobs), reverse=True)[:top]
+        return {
+            "concurrency": self.concurrency,
+            "running": self.running,
+            "queued": self.queued,
+            "tenants_waiting": len(self._ring),
+            "busiest": [
+                {"tenant": tq.tenant[:12], "queued": len(tq.jobs), "weight": tq.weight}
+                for tq in busiest
+            ],
+        }
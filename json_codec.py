@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Pluggable JSON codec for the send path
+Uses orjson when installed (bytes in, bytes out, no intermediate str) and
+falls back to the stdlib json module otherwise
+"""
+
+import json
+import os
+from typing import Any, Callable, Dict, Union
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+class JsonCodec:
+    """A named pair of dumps (object -> bytes) and loads (bytes/str -> object)"""
+
+    def __init__(self, name: str, dumps: Callable[[Any], bytes], loads: Callable[[Union[bytes, str]], Any]):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+    def parse_body(self, content: bytes) -> Any:
+        """Decode an upstream body once: JSON when possible, text otherwise"""
+        if not content:
+            return None
+        try:
+            return self.loads(content)
+        except ValueError:
+            return content.decode("utf-8", errors="replace")
+
+    def error_text(self, status_code: int, body: Any) -> str:
+        """Error line built from an already-parsed body, so the content isn't decoded twice"""
+        if body is None or isinstance(body, str):
+            return f"API error {status_code}: {body or ''}"
+        return f"API error {status_code}: {self.dumps(body).decode('utf-8')}"
+
+
+# Reused encoder: json.dumps with non-default options builds a new one per call
+_stdlib_encoder = json.JSONEncoder(separators=(",", ":"))
+
+
+def _stdlib_dumps(obj: Any) -> bytes:
+    return _stdlib_encoder.encode(obj).encode("utf-8")
+
+
+def _stdlib_loads(data: Union[bytes, str]) -> Any:
+    # json.loads(bytes) sniffs the encoding first; API bodies are UTF-8
+    return json.loads(data.decode("utf-8") if isinstance(data, (bytes, bytearray)) else data)
+
+
+CODECS: Dict[str, JsonCodec] = {
+    "stdlib": JsonCodec("stdlib", _stdlib_dumps, _stdlib_loads),
+}
+if ORJSON_AVAILABLE:
+    CODECS["orjson"] = JsonCodec("orjson", orjson.dumps, orjson.loads)
+
+
+def get_codec(name: str = None) -> JsonCodec:
+    """Codec by name (LEMON_EMAIL_JSON_CODEC), defaulting to the fastest installed"""
+    name = name or os.getenv("LEMON_EMAIL_JSON_CODEC") or ("orjson" if ORJSON_AVAILABLE else "stdlib")
+    if name not in CODECS:
+        raise ValueError(f"Unknown or unavailable JSON codec: {name} (available: {', '.join(CODECS)})")
+    return CODECS[name]
+
+
+codec = get_codec()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Shared validation of send_email payloads
+One precompiled validator checks MCP tool arguments, /send-email bodies and
+whole /send-bulk batches in a single pass, reporting errors per message.
+Uses cached pydantic TypeAdapters, or msgspec when installed and selected
+"""
+
+import os
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from pydantic import Field, TypeAdapter, ValidationError
+from typing_extensions import Annotated, Literal, Required, TypedDict
+
+try:
+    import msgspec
+    MSGSPEC_AVAILABLE = True
+except ImportError:
+    MSGSPEC_AVAILABLE = False
+
+# Both backends read their own constraint metadata and ignore the other's
+if MSGSPEC_AVAILABLE:
+    NonEmptyStr = Annotated[str, Field(min_length=1), msgspec.Meta(min_length=1)]
+else:
+    NonEmptyStr = Annotated[str, Field(min_length=1)]
+
+
+class EmailPayload(TypedDict, total=False):
+    """send_email arguments; unknown keys are dropped, defaults are left to send_email"""
+    to: Required[NonEmptyStr]
+    subject: Required[NonEmptyStr]
+    body: Required[NonEmptyStr]
+    fromemail: Required[NonEmptyStr]
+    fromname: str
+    toname: str
+    tag: str
+    variables: Optional[Dict[str, Any]]
+    replyto: Optional[str]
+    body_format: Literal["html", "plain", "markdown"]
+
+
+class AttachmentSpec(TypedDict, total=False):
+    path: str
+    url: str
+    filename: str
+    content_type: str
+
+
+class ToolEmailPayload(EmailPayload, total=False):
+    """MCP send_email arguments: local attachments are only allowed here"""
+    attachments: List[AttachmentSpec]
+
+
+class SendEmailRequest(EmailPayload, total=False):
+    """/send-email body"""
+    api_key: Required[NonEmptyStr]
+
+
+class BulkEmailEnvelope(TypedDict):
+    """/send-bulk body; messages are validated one by one with EmailPayload"""
+    messages: List[Any]
+    api_key: NonEmptyStr
+
+
+class PayloadError(ValueError):
+    """Raised when a payload fails validation
+
+    ``details`` holds pydantic-style ``{"type", "loc", "msg", "input"}`` dicts
+    (the shape FastAPI returns in 422 bodies); ``errors`` one line per problem.
+    """
+
+    def __init__(self, details: List[Dict[str, Any]]):
+        self.details = details
+        self.errors = [error_line(detail) for detail in details]
+        super().__init__("; ".join(self.errors))
+
+
+def error_line(detail: Dict[str, Any]) -> str:
+    loc = ".".join(str(part) for part in detail["loc"])
+    return f"{loc}: {detail['msg']}" if loc else detail["msg"]
+
+
+def error_detail(type_: str, msg: str, loc: Tuple = (), input_: Any = None) -> Dict[str, Any]:
+    return {"type": type_, "loc": list(loc), "msg": msg, "input": input_}
+
+
+class PydanticValidator:
+    """Validation through TypeAdapters built once per schema"""
+
+    name = "pydantic"
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def adapter(schema) -> TypeAdapter:
+        return TypeAdapter(schema)
+
+    @staticmethod
+    def details(error: ValidationError) -> List[Dict[str, Any]]:
+        return [
+            error_detail(item["type"], item["msg"], item["loc"], item.get("input"))
+            for item in error.errors(include_url=False, include_context=False)
+        ]
+
+    def validate(self, data: Any, schema=EmailPayload) -> Dict[str, Any]:
+        try:
+            return self.adapter(schema).validate_python(data)
+        except ValidationError as e:
+            raise PayloadError(self.details(e))
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def batch_adapter(schema) -> TypeAdapter:
+        # Items that fail the schema fall through to Any unchanged, so a single
+        # pass validates the batch and pinpoints the bad items
+        item = Annotated[Union[schema, Any], Field(union_mode="left_to_right")]
+        return TypeAdapter(List[item])
+
+    def validate_many(self, items: Any, schema=EmailPayload) -> Tuple[List[Optional[Dict[str, Any]]], Dict[int, List[str]]]:
+        try:
+            results = self.batch_adapter(schema).validate_python(items)
+        except ValidationError as e:
+            raise PayloadError(self.details(e))
+        errors: Dict[int, List[str]] = {}
+        for index, item in enumerate(items):
+            # Validated TypedDicts are always new objects
+            if results[index] is item:
+                results[index] = None
+                try:
+                    results[index] = self.validate(item, schema)
+                except PayloadError as e:
+                    errors[index] = e.errors
+        return results, errors
+
+
+# msgspec reports e.g. "Expected `str`, got `int` - at `$.variables[0]`"
+MSGSPEC_PATH = re.compile(r"^(.*) - at `\$(.*)`$")
+MSGSPEC_PATH_PART = re.compile(r"\.([^.\[]+)|\[(\d+)\]")
+MSGSPEC_MISSING = re.compile(r"^Object missing required field `(.+)`$")
+
+
+class MsgspecValidator:
+    """Validation through msgspec.convert (strict types, first error per item)"""
+
+    name = "msgspec"
+
+    @staticmethod
+    def details(error: "msgspec.ValidationError", data: Any) -> List[Dict[str, Any]]:
+        """msgspec's one-line error in the same shape as pydantic's"""
+        msg, loc = str(error), []
+        match = MSGSPEC_PATH.match(msg)
+        if match:
+            msg = match.group(1)
+            loc = [int(index) if index else key for key, index in MSGSPEC_PATH_PART.findall(match.group(2))]
+        value = data
+        for part in loc:
+            try:
+                value = value[part]
+            except (KeyError, IndexError, TypeError):
+                value = None
+                break
+        missing = MSGSPEC_MISSING.match(msg)
+        if missing:
+            # Like pydantic: the missing field joins the loc, the input is its parent
+            return [error_detail("missing", "Field required", (*loc, missing.group(1)), value)]
+        return [error_detail("value_error", msg, loc, value)]
+
+    def validate(self, data: Any, schema=EmailPayload) -> Dict[str, Any]:
+        try:
+            return msgspec.convert(data, schema)
+        except msgspec.ValidationError as e:
+            raise PayloadError(self.details(e, data))
+
+    def validate_many(self, items: Any, schema=EmailPayload) -> Tuple[List[Optional[Dict[str, Any]]], Dict[int, List[str]]]:
+        if not isinstance(items, list):
+            raise PayloadError([error_detail("list_type", "Input should be a valid list", (), items)])
+        try:
+            return msgspec.convert(items, List[schema]), {}
+        except msgspec.ValidationError:
+            pass
+        # msgspec stops at the first error; recheck item by item to report all of them
+        results: List[Optional[Dict[str, Any]]] = []
+        errors: Dict[int, List[str]] = {}
+        for index, item in enumerate(items):
+            try:
+                results.append(msgspec.convert(item, schema))
+            except msgspec.ValidationError as e:
+                results.append(None)
+                errors[index] = PayloadError(self.details(e, item)).errors
+        return results, errors
+
+
+SCHEMAS = (EmailPayload, ToolEmailPayload, SendEmailRequest, BulkEmailEnvelope)
+
+# Build every adapter up front rather than on the first request
+for _schema in SCHEMAS:
+    PydanticValidator.adapter(_schema)
+    PydanticValidator.batch_adapter(_schema)
+
+VALIDATORS: Dict[str, Any] = {"pydantic": PydanticValidator()}
+if MSGSPEC_AVAILABLE:
+    VALIDATORS["msgspec"] = MsgspecValidator()
+
+
+def get_validator(name: str = None):
+    """Validator by name (LEMON_EMAIL_VALIDATOR), defaulting to pydantic"""
+    name = name or os.getenv("LEMON_EMAIL_VALIDATOR") or "pydantic"
+    if name not in VALIDATORS:
+        raise ValueError(f"Unknown or unavailable validator: {name} (available: {', '.join(VALIDATORS)})")
+    return VALIDATORS[name]
+
+
+def json_schema(schema=EmailPayload) -> Dict[str, Any]:
+    """JSON schema of a payload type, for API docs"""
+    return PydanticValidator.adapter(schema).json_schema()
+
+
+validator = get_validator()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+On-demand profiling of the live event loop
+A stack sampler or cProfile can be run for a window without restarting the
+process, and a loop monitor tracks event-loop lag and captures the stack of
+whatever callback blocks the loop for too long
+"""
+
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, Deque, Dict, List, Optional
+
+MAX_PROFILE_SECONDS = 60.0
+PROFILE_MODES = ("sample", "cprofile")
+
+_profile_lock = asyncio.Lock()
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is requested while another one is running"""
+
+
+def format_stack(frame, limit: int = 64) -> List[str]:
+    """Root-first ``file:function:line`` entries for a frame"""
+    entries = []
+    while frame is not None and len(entries) < limit:
+        code = frame.f_code
+        entries.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    entries.reverse()
+    return entries
+
+
+def sample_stacks(thread_id: int, seconds: float, interval: float = 0.005) -> Counter:
+    """Sample one thread's stack until the window closes (call from another thread)"""
+    stacks: Counter = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        if frame is not None:
+            stacks[";".join(format_stack(frame))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+def collapse(stacks: Counter) -> str:
+    """Brendan Gregg's collapsed-stack format, ready for flamegraph.pl or speedscope"""
+    return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+
+
+async def profile(seconds: float, mode: str = "sample", limit: int = 60) -> str:
+    """Profile the running event loop for ``seconds`` and return a text report
+
+    ``sample`` returns collapsed stacks from a background sampler thread;
+    ``cprofile`` returns pstats for everything the loop thread ran in the window.
+    """
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profile mode: {mode} (expected one of {', '.join(PROFILE_MODES)})")
+    seconds = min(max(seconds, 0.1), MAX_PROFILE_SECONDS)
+    if _profile_lock.locked():
+        raise ProfilerBusy("A profile is already running")
+
+    async with _profile_lock:
+        if mode == "sample":
+            stacks = await asyncio.to_thread(sample_stacks, threading.get_ident(), seconds)
+            return collapse(stacks)
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(limit)
+        return out.getvalue()
+
+
+class LoopMonitor:
+    """Event-loop lag tracker with a watchdog that captures blocking callbacks"""
+
+    def __init__(self, interval: float = 0.1, slow_threshold: float = 0.1, history: int = 600):
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self.lags: Deque[float] = deque(maxlen=history)
+        self.slow_callbacks: Deque[Dict[str, Any]] = deque(maxlen=20)
+        self._last_beat = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    @classmethod
+    def from_env(cls) -> "LoopMonitor":
+        return cls(slow_threshold=float(os.getenv("LEMON_EMAIL_SLOW_CALLBACK_MS", "100")) / 1000)
+
+    def start(self):
+        """Start the heartbeat on the running loop and the watchdog thread"""
+        if self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stopping.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stopping.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.lags.append(max(0.0, now - expected))
+            self._last_beat = now
+
+    def _watch(self):
+        reported_beat = None
+        while not self._stopping.wait(self.slow_threshold / 2):
+            beat = self._last_beat
+            blocked = time.monotonic() - beat - self.interval
+            if blocked < self.slow_threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if beat != reported_beat:
+                # First sighting of this stall: capture what the loop is running
+                reported_beat = beat
+                self.slow_callbacks.append({
+                    "at": time.time(),
+                    "blocked_ms": round(blocked * 1000, 1),
+                    "stack": format_stack(frame) if frame is not None else [],
+                })
+            else:
+                self.slow_callbacks[-1]["blocked_ms"] = round(blocked * 1000, 1)
+
+    def stats(self) -> Dict[str, Any]:
+        ordered = sorted(self.lags)
+        pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2) if ordered else None
+        return {
+            "running": self._task is not None,
+            "samples": len(ordered),
+            "lag_p50_ms": pick(0.50),
+            "lag_p99_ms": pick(0.99),
+            "lag_max_ms": round(ordered[-1] * 1000, 2) if ordered else None,
+            "slow_callback_threshold_ms": round(self.slow_threshold * 1000, 1),
+            "slow_callbacks": list(self.slow_callbacks),
+        }
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Pre-flight recipient validation for the Lemon Email API
+Rejects malformed addresses, disposable domains and domains without mail
+servers before a send spends an upstream round-trip and quota
+"""
+
+import asyncio
+import os
+import re
+import socket
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+try:
+    import dns.asyncresolver
+    import dns.resolver
+    DNSPYTHON_AVAILABLE = True
+except ImportError:
+    DNSPYTHON_AVAILABLE = False
+
+# Pragmatic RFC 5322 subset: dot-atom local part, LDH labels, alphabetic TLD
+EMAIL_PATTERN = re.compile(
+    r"^(?=.{3,254}$)(?=[^@]{1,64}@)"
+    r"[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+(?:\.[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+)*"
+    r"@((?:[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?\.)+[A-Za-z]{2,63})$"
+)
+
+DEFAULT_DISPOSABLE_DOMAINS = frozenset({
+    "10minutemail.com",
+    "discard.email",
+    "dispostable.com",
+    "fakeinbox.com",
+    "getnada.com",
+    "guerrillamail.com",
+    "maildrop.cc",
+    "mailinator.com",
+    "mintemail.com",
+    "mytemp.email",
+    "sharklasers.com",
+    "temp-mail.org",
+    "tempmail.com",
+    "throwawaymail.com",
+    "trashmail.com",
+    "yopmail.com",
+})
+
+# A resolver maps a domain to the hosts that accept its mail; an empty list
+# means the domain does not receive mail, an exception means "don't know"
+Resolver = Callable[[str], Awaitable[List[str]]]
+
+
+async def address_resolver(domain: str) -> List[str]:
+    """Fallback resolver using the loop's getaddrinfo (implicit MX, RFC 5321 5.1)
+
+    getaddrinfo cannot tell a missing domain from a resolver that merely
+    failed (EAI_NONAME covers both on many platforms), so every failure is
+    "don't know": the address is let through and nothing is cached.
+    """
+    loop = asyncio.get_running_loop()
+    infos = await loop.getaddrinfo(domain, 25, type=socket.SOCK_STREAM)
+    hosts = sorted({info[4][0] for info in infos})
+    if not hosts:
+        raise LookupError(f"No address records returned for {domain}")
+    return hosts
+
+
+async def dns_address_resolver(domain: str) -> List[str]:
+    """A/AAAA lookup via dnspython, where "no records" is an authoritative answer"""
+    hosts: List[str] = []
+    for rdtype in ("A", "AAAA"):
+        try:
+            answer = await dns.asyncresolver.resolve(domain, rdtype, lifetime=5.0)
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+            continue
+        hosts.extend(r.address for r in answer)
+    return hosts
+
+
+async def mx_resolver(domain: str) -> List[str]:
+    """MX lookup via dnspython, falling back to address records when there is no MX"""
+    try:
+        answer = await dns.asyncresolver.resolve(domain, "MX", lifetime=5.0)
+    except dns.resolver.NXDOMAIN:
+        return []
+    except dns.resolver.NoAnswer:
+        return await dns_address_resolver(domain)
+    # A null MX ("0 .") explicitly says the domain accepts no mail
+    return [host for host in (str(r.exchange).rstrip(".") for r in answer) if host]
+
+
+def default_resolver() -> Resolver:
+    return mx_resolver if DNSPYTHON_AVAILABLE else address_resolver
+
+
+def load_disposable_domains(path: Optional[str]) -> FrozenSet[str]:
+    """Built-in disposable domains, extended by one-domain-per-line file if given"""
+    if not path:
+        return DEFAULT_DISPOSABLE_DOMAINS
+    with open(path, encoding="utf-8") as f:
+        extra = {line.strip().lower() for line in f if line.strip() and not line.startswith("#")}
+    return DEFAULT_DISPOSABLE_DOMAINS | extra
+
+
+class RecipientValidator:
+    """Syntax, disposable-domain and cached MX checks for recipient addresses"""
+
+    def __init__(
+        self,
+        resolver: Optional[Resolver] = None,
+        check_mx: bool = True,
+        disposable_domains: FrozenSet[str] = DEFAULT_DISPOSABLE_DOMAINS,
+        ttl: float = 3600.0,
+        negative_ttl: float = 300.0,
+        max_entries: int = 10000,
+    ):
+        self.resolver = resolver or default_resolver()
+        self.check_mx = check_mx
+        self.disposable_domains = disposable_domains
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        # domain -> (expires_at, error or None)
+        self._cache: "OrderedDict[str, Tuple[float, Optional[str]]]" = OrderedDict()
+        self._inflight: Dict[str, "asyncio.Future[Optional[str]]"] = {}
+        self.lookups = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["RecipientValidator"]:
+        """Validator configured from env, or None when validation is disabled"""
+        if os.getenv("LEMON_EMAIL_VALIDATE_RECIPIENTS", "").lower() not in ("1", "true", "yes"):
+            return None
+        return cls(
+            check_mx=os.getenv("LEMON_EMAIL_VALIDATE_MX", "1").lower() in ("1", "true", "yes"),
+            disposable_domains=load_disposable_domains(os.getenv("LEMON_EMAIL_DISPOSABLE_DOMAINS_FILE")),
+            ttl=float(os.getenv("LEMON_EMAIL_MX_CACHE_TTL", "3600")),
+            negative_ttl=float(os.getenv("LEMON_EMAIL_MX_NEGATIVE_TTL", "300")),
+        )
+
+    def check_syntax(self, address: str) -> Tuple[Optional[str], Optional[str]]:
+        """Return (domain, error) for the local checks that need no I/O"""
+        match = EMAIL_PATTERN.match(address.strip())
+        if not match:
+            return None, "malformed address"
+        domain = match.group(1).lower()
+        if domain in self.disposable_domains:
+            return domain, "disposable email domain"
+        return domain, None
+
+    async def validate(self, address: str) -> Optional[str]:
+        """Return an error message for an undeliverable address, None if it looks fine"""
+        domain, error = self.check_syntax(address)
+        if error or not self.check_mx:
+            return error
+        return await self._domain_error(domain)
+
+    async def validate_many(self, addresses: Iterable[str]) -> Dict[str, Optional[str]]:
+        """Validate a batch, resolving each distinct domain only once"""
+        results: Dict[str, Optional[str]] = {}
+        pending: Dict[str, List[str]] = {}
+        for address in addresses:
+            if address in results:
+                continue
+            domain, error = self.check_syntax(address)
+            results[address] = error
+            if error is None and self.check_mx:
+                pending.setdefault(domain, []).append(address)
+
+        domains = list(pending)
+        errors = await asyncio.gather(*(self._domain_error(domain) for domain in domains))
+        for domain, error in zip(domains, errors):
+            for address in pending[domain]:
+                results[address] = error
+        return results
+
+    async def _domain_error(self, domain: str) -> Optional[str]:
+        now = time.monotonic()
+        cached = self._cache.get(domain)
+        if cached is not None:
+            if cached[0] > now:
+                self._cache.move_to_end(domain)
+                return cached[1]
+            del self._cache[domain]
+
+        # Concurrent sends to the same domain share one lookup
+        inflight = self._inflight.get(domain)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[domain] = future
+        try:
+            self.lookups += 1
+            try:
+                hosts = await self.resolver(domain)
+            except Exception:
+                # DNS trouble must not block mail; fail open and don't cache
+                error = None
+            else:
+                error = None if hosts else "domain does not accept email (no MX or address records)"
+                self._store(domain, error)
+            future.set_result(error)
+            return error
+        finally:
+            del self._inflight[domain]
+            if not future.done():
+                future.cancel()
+
+    def _store(self, domain: str, error: Optional[str]):
+        ttl = self.ttl if error is None else self.negative_ttl
+        self._cache[domain] = (time.monotonic() + ttl, error)
+        self._cache.move_to_end(domain)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Runtime mode selection for the Lemon Email servers
+The default mode keeps stock asyncio/uvicorn settings; the performance mode
+(LEMON_EMAIL_RUNTIME=performance or --performance) switches to uvloop and
+httptools when installed and tunes uvicorn for throughput
+"""
+
+import asyncio
+import os
+import sys
+from typing import Any, Coroutine, Dict, List, Optional
+
+try:
+    import uvloop
+    UVLOOP_AVAILABLE = True
+except ImportError:
+    UVLOOP_AVAILABLE = False
+
+try:
+    import httptools  # noqa: F401 - uvicorn imports it itself, we only probe
+    HTTPTOOLS_AVAILABLE = True
+except ImportError:
+    HTTPTOOLS_AVAILABLE = False
+
+PERFORMANCE_FLAG = "--performance"
+
+
+def performance_mode_enabled(argv: Optional[List[str]] = None) -> bool:
+    """True when selected via env var or CLI flag"""
+    argv = sys.argv[1:] if argv is None else argv
+    if PERFORMANCE_FLAG in argv:
+        return True
+    return os.getenv("LEMON_EMAIL_RUNTIME", "default").lower() == "performance"
+
+
+def strip_runtime_flags(argv: List[str]) -> List[str]:
+    """argv without the runtime flag, so command dispatch is unaffected"""
+    return [arg for arg in argv if arg != PERFORMANCE_FLAG]
+
+
+def available_cpus() -> int:
+    """CPUs this process may run on (respects affinity/cgroup pinning where exposed)"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def uvicorn_options(performance: bool) -> Dict[str, Any]:
+    """Extra uvicorn.run keyword arguments for the selected mode"""
+    if not performance:
+        return {}
+
+    limit_concurrency = os.getenv("LEMON_EMAIL_LIMIT_CONCURRENCY")
+    return {
+        "loop": "uvloop" if UVLOOP_AVAILABLE else "asyncio",
+        "http": "httptools" if HTTPTOOLS_AVAILABLE else "h11",
+        "workers": int(os.getenv("LEMON_EMAIL_WORKERS", str(available_cpus()))),
+        "backlog": int(os.getenv("LEMON_EMAIL_BACKLOG", "4096")),
+        # Longer than typical load balancer idle timeouts (60s) so the proxy,
+        # not us, closes idle connections and never races a reused socket
+        "timeout_keep_alive": int(os.getenv("LEMON_EMAIL_KEEP_ALIVE", "75")),
+        # Per worker; excess connections get a fast 503 instead of queueing
+        "limit_concurrency": int(limit_concurrency) if limit_concurrency else 2048,
+        "access_log": False,
+    }
+
+
+def describe(performance: bool) -> str:
+    """One-line summary of the runtime for startup banners"""
+    if not performance:
+        return "default (asyncio)"
+    options = uvicorn_options(True)
+    return f"performance ({options['loop']} loop, {options['http']} parser, {options['workers']} worker(s))"
+
+
+def run(coro: Coroutine, performance: bool):
+    """asyncio.run, on uvloop in performance mode when it is installed"""
+    if performance and UVLOOP_AVAILABLE:
+        if hasattr(uvloop, "run"):
+            return uvloop.run(coro)
+        uvloop.install()
+    return asyncio.run(coro)
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Graceful shutdown for the Lemon Email servers
+Stops admitting sends, lets in-flight upstream calls finish within a drain
+deadline and saves whatever is still pending to a durable JSONL file
+"""
+
+import asyncio
+import itertools
+import os
+import signal
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional
+
+from api_key_cache import hash_api_key
+from json_codec import codec
+
+
+class ShuttingDown(Exception):
+    """Raised when a send is submitted after draining has started"""
+
+
+def pending_record(payload: Dict[str, Any], api_key: Optional[str] = None) -> Dict[str, Any]:
+    """Durable form of an unsent message; API keys are stored only as a hash"""
+    record = dict(payload)
+    if api_key:
+        record["api_key_sha256"] = hash_api_key(api_key)
+    return record
+
+
+def with_state(records: Iterable[Dict[str, Any]], state: str) -> Iterator[Dict[str, Any]]:
+    """Tag send records with where they were at shutdown ("in_flight" or "queued")"""
+    for record in records:
+        yield record if "shared" in record else {**record, "state": state}
+
+
+class PendingStore:
+    """Append-only JSONL file of sends that did not complete before shutdown
+
+    Each send record has a ``state``: ``"in_flight"`` sends were cancelled
+    mid-request and may already have been delivered, ``"queued"`` ones never
+    started. Besides send records the file may hold ``{"shared": ref, "value": text}``
+    lines; later records point at them with ``<field>_ref`` instead of
+    repeating large shared fields such as a campaign body (a shared line may
+    appear again later with the same ref and value).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @classmethod
+    def from_env(cls) -> "PendingStore":
+        return cls(os.getenv("LEMON_EMAIL_PENDING_FILE", "pending_sends.jsonl"))
+
+    def save(self, records: Iterable[Dict[str, Any]]) -> int:
+        """Stream records to the file and fsync; returns how many sends were written
+
+        Every worker of a multi-process server appends to the same file at
+        shutdown, so each line goes out in a single O_APPEND write and lines
+        from different processes never interleave mid-line.
+        """
+        count = 0
+        fd = None
+        saved_at = time.time()
+        try:
+            for record in records:
+                if fd is None:
+                    # Only create the file when there is something to save
+                    fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+                if "shared" in record:
+                    os.write(fd, codec.dumps(record) + b"\n")
+                    continue
+                os.write(fd, codec.dumps({**record, "saved_at": saved_at}) + b"\n")
+                count += 1
+        finally:
+            if fd is not None:
+                os.fsync(fd)
+                os.close(fd)
+        return count
+
+
+class DrainController:
+    """Tracks in-flight sends so shutdown can wait for them or persist them"""
+
+    def __init__(self, deadline: float = 25.0, store: Optional[PendingStore] = None):
+        self.deadline = deadline
+        self.store = store or PendingStore.from_env()
+        self.admitting = True
+        # When shutdown began; the drain gets what is left of the deadline
+        self.shutdown_started: Optional[float] = None
+        self._in_flight: Dict["asyncio.Task", Dict[str, Any]] = {}
+        # Queues that hold not-yet-started sends; each returns an iterable that
+        # hands over (and forgets) their records, consumed while saving
+        self._pending_sources: List[Callable[[], Iterable[Dict[str, Any]]]] = []
+
+    @classmethod
+    def from_env(cls) -> "DrainController":
+        return cls(deadline=float(os.getenv("LEMON_EMAIL_DRAIN_TIMEOUT", "25")))
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+    def add_pending_source(self, source: Callable[[], Iterable[Dict[str, Any]]]):
+        self._pending_sources.append(source)
+
+    def mark_shutdown(self):
+        """Note when shutdown began (the first call wins)"""
+        if self.shutdown_started is None:
+            self.shutdown_started = time.monotonic()
+
+    def remaining(self) -> float:
+        """Seconds left of the deadline since shutdown began"""
+        if self.shutdown_started is None:
+            return self.deadline
+        return max(self.deadline - (time.monotonic() - self.shutdown_started), 0.0)
+
+    def watch_signals(self, signals=(signal.SIGINT, signal.SIGTERM)):
+        """Mark shutdown on a signal, then pass it to the handler already installed
+
+        Call while the server's own handlers are in place (e.g. at lifespan
+        startup under uvicorn), so time its graceful phase spends waiting on
+        open requests counts against the same deadline.
+        """
+        for sig in signals:
+            previous = signal.getsignal(sig)
+            if not callable(previous):
+                continue
+
+            def handler(signum, frame, previous=previous):
+                self.mark_shutdown()
+                previous(signum, frame)
+
+            try:
+                signal.signal(sig, handler)
+            except ValueError:
+                # Not the main thread; the drain falls back to the full deadline
+                return
+
+    def stop_admitting(self):
+        """Refuse new sends from now on (drain() also does this)"""
+        self.admitting = False
+
+    def admit(self):
+        """Raise ShuttingDown once draining has started"""
+        if not self.admitting:
+            raise ShuttingDown("Server is shutting down, not accepting new sends")
+
+    def track(self, send: Awaitable[Dict[str, Any]], record: Dict[str, Any], admitted: bool = False) -> "asyncio.Task":
+        """Run a send as a tracked task; it survives cancellation of the caller
+
+        ``record`` is what gets persisted if the send is abandoned at shutdown.
+        ``admitted`` marks work accepted before draining began (e.g. queued
+        sends), which may still start while the drain deadline runs.
+        """
+        if not admitted and not self.admitting:
+            if asyncio.iscoroutine(send):
+                send.close()
+            self.admit()
+        task = asyncio.ensure_future(send)
+        self._in_flight[task] = record
+        task.add_done_callback(lambda t: self._in_flight.pop(t, None))
+        return task
+
+    async def run(self, send: Awaitable[Dict[str, Any]], record: Dict[str, Any]) -> Dict[str, Any]:
+        """Track a send and await it without letting caller cancellation abort it"""
+        return await asyncio.shield(self.track(send, record))
+
+    async def drain(self, deadline: Optional[float] = None) -> Dict[str, Any]:
+        """Stop admitting, wait up to the deadline, persist and cancel the rest
+
+        Without an explicit ``deadline`` only the time left since
+        ``mark_shutdown`` is used, so shutdown as a whole stays within it.
+        """
+        self.mark_shutdown()
+        deadline = self.remaining() if deadline is None else deadline
+        self.stop_admitting()
+        start = time.monotonic()
+        completed = 0
+
+        # Queued sends may start while we wait, so keep waiting on the live set
+        while self._in_flight:
+            remaining = start + deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, _ = await asyncio.wait(list(self._in_flight), timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            completed += len(done)
+
+        # Stop the queues first so cancelled sends don't make room for new ones
+        queued = [source() for source in self._pending_sources]
+        in_flight = list(self._in_flight.values())
+        for task in list(self._in_flight):
+            task.cancel()
+
+        # Streamed: a large backlog is never materialised as one list
+        saved = self.store.save(itertools.chain(
+            with_state(in_flight, "in_flight"),
+            *(with_state(records, "queued") for records in queued),
+        ))
+        return {
+            "drain_seconds": round(time.monotonic() - start, 3),
+            "completed": completed,
+            "abandoned": saved,
+            "saved": saved,
+            "pending_file": self.store.path if saved else None,
+        }
@@ -6,11 +6,25 @@ Lemon Email MCP Server - Fixed Version with Proper CallToolResult Handling
 import asyncio
 import json
 import os
+import signal
 import sys
+import time
+import uuid
 from typing import Any, Dict, List, Optional
 
 import httpx
 
+import attachments as attachment_streams
+from attachments import AttachmentError, AttachmentSource
+from body_rendering import TEXT_BODY_FIELD, BodyRenderer
+from json_codec import codec
+from payload_validation import PayloadError, ToolEmailPayload, validator
+import profiling
+from recipient_validation import RecipientValidator
+import runtime_mode
+from shutdown import DrainController, ShuttingDown, pending_record
+from upstream_pool import UpstreamPool
+
 # MCP imports with error handling
 try:
     from mcp.server.models import InitializationOptions
@@ -33,13 +47,120 @@ except ImportError as e:
 SERVER_NAME = "lemon-email"
 SERVER_VERSION = "1.0.0"
 
+# Upper bound on upstream body bytes echoed back to the agent in tool results
+MAX_RESPONSE_BYTES = int(os.getenv("LEMON_EMAIL_MAX_RESPONSE_BYTES", "512"))
+MESSAGE_ID_KEYS = ("message_id", "messageId", "messageid", "id")
+
+# Opt-in profile_server tool for diagnosing throughput drops in a live process
+PROFILING_TOOL_ENABLED = os.getenv("LEMON_EMAIL_ENABLE_PROFILING_TOOL", "").lower() in ("1", "true", "yes")
+PROFILE_OUTPUT_BYTES = 64 * 1024
+loop_monitor = profiling.LoopMonitor.from_env() if PROFILING_TOOL_ENABLED else None
+
+SEND_EMAIL_OUTPUT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "success": {"type": "boolean"},
+        "status_code": {"type": "integer"},
+        "message_id": {"type": "string"},
+        "elapsed_ms": {"type": "number"},
+        "endpoint": {"type": "string"},
+        "error": {"type": "string"},
+        "response": {"description": "Upstream body, truncated to LEMON_EMAIL_MAX_RESPONSE_BYTES"}
+    },
+    "required": ["success"]
+}
+
+def truncate_text(text: str, max_bytes: int = MAX_RESPONSE_BYTES) -> str:
+    """Cut a string to at most max_bytes of UTF-8, noting how much was dropped"""
+    encoded = text.encode("utf-8")
+    if len(encoded) <= max_bytes:
+        return text
+    kept = encoded[:max_bytes].decode("utf-8", errors="ignore")
+    return f"{kept}…[truncated {len(encoded) - max_bytes} bytes]"
+
+def truncate_body(body: Any, max_bytes: int = MAX_RESPONSE_BYTES) -> Any:
+    """Keep small structured bodies as-is, collapse large ones to truncated text"""
+    if body is None:
+        return None
+    if isinstance(body, str):
+        return truncate_text(body, max_bytes)
+    encoded = codec.dumps(body)
+    if len(encoded) <= max_bytes:
+        return body
+    return truncate_text(encoded.decode("utf-8"), max_bytes)
+
+def extract_message_id(body: Any) -> Optional[str]:
+    """Find the upstream message id in a parsed response, if it has one"""
+    if isinstance(body, dict):
+        for key in MESSAGE_ID_KEYS:
+            if body.get(key) not in (None, ""):
+                return str(body[key])
+        if isinstance(body.get("data"), dict):
+            return extract_message_id(body["data"])
+    return None
+
+def summarize_send_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Compact structured tool output for a send_email result"""
+    summary: Dict[str, Any] = {"success": result["success"]}
+    for key in ("status_code", "elapsed_ms", "endpoint"):
+        if result.get(key) is not None:
+            summary[key] = result[key]
+    message_id = extract_message_id(result.get("response"))
+    if message_id:
+        summary["message_id"] = message_id
+    elif result.get("response") is not None:
+        summary["response"] = truncate_body(result["response"])
+    if not result["success"]:
+        summary["error"] = truncate_text(result.get("error", "Unknown error"))
+    return summary
+
+def tool_result(structured: Dict[str, Any]) -> "CallToolResult":
+    """Structured content plus its compact JSON text mirror for older clients
+
+    Results with ``"success": False`` (failed sends, invalid arguments,
+    unknown tools) are flagged ``isError`` so agents can tell them apart.
+    """
+    return CallToolResult(
+        content=[TextContent(type="text", text=codec.dumps(structured).decode("utf-8"))],
+        structuredContent=structured,
+        isError=not structured.get("success", True),
+    )
+
 class LemonEmailServer:
     def __init__(self):
-        self.api_base_url = os.getenv("LEMON_EMAIL_API_BASE_URL", "https://app.xn--lemn-sqa.com/api")
+        self.upstream = UpstreamPool.from_env(retryable=(httpx.ConnectError, httpx.ConnectTimeout))
+        self.api_base_url = self.upstream.primary_url
         self.api_key = os.getenv("LEMON_EMAIL_API_KEY")
+        # Only set when the upstream honours Idempotency-Key; enables hedging
+        self.idempotent = os.getenv("LEMON_EMAIL_API_IDEMPOTENCY", "").lower() in ("1", "true", "yes")
+        self.validator = RecipientValidator.from_env()
+        self.drain = DrainController.from_env()
+        # Plain/Markdown bodies are rendered to HTML in worker processes
+        self.renderer = BodyRenderer.from_env()
         
         if not self.api_key:
             raise ValueError("LEMON_EMAIL_API_KEY environment variable is required")
+        
+        # Request scaffolding that never changes between sends
+        self.send_urls = self.upstream.url_map("/transactional/send")
+        self.headers = {
+            "Content-Type": "application/json",
+            "X-Auth-APIKey": self.api_key
+        }
+        self._client: Optional[httpx.AsyncClient] = None
+    
+    def client(self) -> httpx.AsyncClient:
+        """Pooled HTTP client, created lazily inside the running event loop"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(timeout=30.0)
+        return self._client
+    
+    async def aclose(self):
+        """Close pooled upstream connections"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        self.renderer.shutdown()
     
     async def send_email(
         self,
@@ -51,9 +172,36 @@ class LemonEmailServer:
         toname: str = "",
         tag: str = "mcp-agent",
         variables: Optional[Dict[str, Any]] = None,
-        replyto: Optional[str] = None
+        replyto: Optional[str] = None,
+        attachments: Optional[List[AttachmentSource]] = None,
+        body_format: Optional[str] = None
     ) -> Dict[str, Any]:
-        """Send an email using the Lemon Email API"""
+        """Send an email using the Lemon Email API
+        
+        Attachments are streamed into the request body chunk by chunk rather
+        than loaded whole. A ``plain`` or ``markdown`` body_format renders the
+        body to HTML with a text alternative; the default sends it as-is.
+        """
+        
+        start = time.perf_counter()
+        
+        if self.validator:
+            error = await self.validator.validate(to)
+            if error:
+                return {
+                    "success": False,
+                    "error": f"Invalid recipient {to}: {error}"
+                }
+        
+        if body_format and body_format != "html":
+            try:
+                rendered = await self.renderer.render(body, body_format)
+            except Exception as e:
+                return {
+                    "success": False,
+                    "error": f"Could not render {body_format} body: {str(e)}"
+                }
+            body = rendered["html"]
         
         if not replyto:
             replyto = fromemail
@@ -69,52 +217,94 @@ class LemonEmailServer:
             "variables": variables or {},
             "replyto": replyto
         }
+        if body_format and body_format != "html" and TEXT_BODY_FIELD:
+            payload[TEXT_BODY_FIELD] = rendered["text"]
         
-        headers = {
-            "Content-Type": "application/json",
-            "X-Auth-APIKey": self.api_key
-        }
+        headers = self.headers
+        if self.idempotent:
+            headers = {**headers, "Idempotency-Key": uuid.uuid4().hex}
+        content = codec.dumps(payload)
+        body_stream = None
+        if attachments:
+            # A fresh stream per attempt so failover and hedging can re-send it
+            body_stream = attachment_streams.request_body(content, attachments, codec.dumps)
+            if attachment_streams.GZIP_ATTACHMENTS:
+                headers = {**headers, "Content-Encoding": "gzip"}
+        client = self.client()
         
-        url = f"{self.api_base_url}/transactional/send"
+        async def post(base_url: str):
+            return await client.post(
+                self.send_urls[base_url],
+                headers=headers,
+                content=body_stream() if body_stream else content
+            )
         
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.post(
-                    url, 
-                    headers=headers, 
-                    json=payload,
-                    timeout=30.0
-                )
-                
-                response_data = {
-                    "status_code": response.status_code,
-                    "response": response.text,
-                    "success": response.is_success
-                }
-                
-                if not response.is_success:
-                    response_data["error"] = f"API error {response.status_code}: {response.text}"
-                
-                return response_data
-                
-            except httpx.TimeoutException:
-                return {
-                    "success": False,
-                    "error": "Request timed out after 30 seconds"
-                }
-            except Exception as e:
-                return {
-                    "success": False,
-                    "error": f"Network error: {str(e)}"
-                }
+        try:
+            response, endpoint = await self.upstream.request(post, idempotent=self.idempotent)
+            
+            result = codec.parse_body(response.content)
+            response_data = {
+                "status_code": response.status_code,
+                "response": result,
+                "success": response.is_success,
+                "endpoint": endpoint,
+                "elapsed_ms": round((time.perf_counter() - start) * 1000, 1)
+            }
+            
+            if not response.is_success:
+                response_data["error"] = codec.error_text(response.status_code, result)
+            
+            return response_data
+            
+        except httpx.TimeoutException:
+            return {
+                "success": False,
+                "error": "Request timed out after 30 seconds"
+            }
+        except AttachmentError as e:
+            return {
+                "success": False,
+                "error": str(e)
+            }
+        except Exception as e:
+            return {
+                "success": False,
+                "error": f"Network error: {str(e)}"
+            }
+
+PROFILE_TOOL = Tool(
+    name="profile_server",
+    description=(
+        "Profile this MCP server's event loop for a few seconds and report "
+        "collapsed stacks or cProfile stats, plus event-loop lag and slow callbacks."
+    ),
+    inputSchema={
+        "type": "object",
+        "properties": {
+            "seconds": {
+                "type": "number",
+                "description": "Profiling window in seconds",
+                "default": 5,
+                "exclusiveMinimum": 0,
+                "maximum": profiling.MAX_PROFILE_SECONDS
+            },
+            "mode": {
+                "type": "string",
+                "enum": list(profiling.PROFILE_MODES),
+                "description": "sample: collapsed stacks, cprofile: pstats",
+                "default": "sample"
+            }
+        }
+    }
+) if MCP_AVAILABLE else None
 
-def create_server():
+def create_server(email_server: Optional[LemonEmailServer] = None):
     """Create and configure the MCP server"""
     if not MCP_AVAILABLE:
         raise ImportError("MCP library not available")
         
     server = Server(SERVER_NAME)
-    email_server = LemonEmailServer()
+    email_server = email_server or LemonEmailServer()
     
     @server.list_tools()
     async def list_tools() -> List[Tool]:
@@ -141,6 +331,12 @@ def create_server():
                             "type": "string",
                             "description": "Email body content"
                         },
+                        "body_format": {
+                            "type": "string",
+                            "enum": ["html", "plain", "markdown"],
+                            "description": "How to read body: html is sent as-is, plain and markdown are rendered to styled HTML with a text alternative",
+                            "default": "html"
+                        },
                         "fromname": {
                             "type": "string",
                             "description": "Sender name",
@@ -168,72 +364,103 @@ def create_server():
                         "replyto": {
                             "type": "string",
                             "description": "Reply-to email address"
+                        },
+                        "attachments": {
+                            "type": "array",
+                            "description": "Files to attach from this server's LEMON_EMAIL_ATTACHMENT_DIR, streamed from disk",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "path": {
+                                        "type": "string",
+                                        "description": "File path, relative to (or inside) the attachment directory"
+                                    },
+                                    "url": {
+                                        "type": "string",
+                                        "description": "file:// URL, as an alternative to path"
+                                    },
+                                    "filename": {
+                                        "type": "string",
+                                        "description": "Name shown to the recipient (defaults to the file name)"
+                                    },
+                                    "content_type": {
+                                        "type": "string",
+                                        "description": "MIME type (guessed from the name if omitted)"
+                                    }
+                                }
+                            }
                         }
                     },
                     "required": ["to", "subject", "body", "fromemail"]
-                }
+                },
+                outputSchema=SEND_EMAIL_OUTPUT_SCHEMA
             )
-        ]
+        ] + ([PROFILE_TOOL] if PROFILING_TOOL_ENABLED else [])
     
     @server.call_tool()
     async def call_tool(name: str, arguments: dict):
-        """Handle tool calls with simplified return"""
+        """Handle tool calls, returning compact structured results"""
         if name == "send_email":
             try:
-                # Validate required fields
-                required = ["to", "subject", "body", "fromemail"]
-                missing = [field for field in required if field not in arguments or not arguments[field]]
+                # Required fields, types and non-empty strings; unknown keys are dropped
+                try:
+                    arguments = validator.validate(arguments, ToolEmailPayload)
+                except PayloadError as e:
+                    return tool_result({
+                        "success": False,
+                        "error": truncate_text(f"Invalid arguments: {e}")
+                    })
                 
-                if missing:
-                    # Return simple dict instead of CallToolResult
-                    return {
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": f"❌ Missing required fields: {', '.join(missing)}"
-                            }
+                send_arguments = dict(arguments)
+                if arguments.get("attachments"):
+                    try:
+                        send_arguments["attachments"] = [
+                            AttachmentSource.from_spec(spec) for spec in arguments["attachments"]
                         ]
-                    }
-                
-                result = await email_server.send_email(**arguments)
+                    except AttachmentError as e:
+                        return tool_result({
+                            "success": False,
+                            "error": str(e)
+                        })
                 
-                if result["success"]:
-                    return {
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": f"✅ Email sent successfully!\nStatus: {result['status_code']}\nResponse: {result['response']}"
-                            }
-                        ]
-                    }
-                else:
-                    return {
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": f"❌ Email failed: {result.get('error', 'Unknown error')}"
-                            }
-                        ]
-                    }
+                result = await email_server.drain.run(
+                    email_server.send_email(**send_arguments),
+                    pending_record(arguments)
+                )
+                return tool_result(summarize_send_result(result))
                     
+            except ShuttingDown as e:
+                return tool_result({
+                    "success": False,
+                    "error": str(e)
+                })
             except Exception as e:
-                return {
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": f"❌ Error sending email: {str(e)}"
-                        }
-                    ]
-                }
+                return tool_result({
+                    "success": False,
+                    "error": truncate_text(f"Error sending email: {str(e)}")
+                })
+        elif name == "profile_server" and PROFILING_TOOL_ENABLED:
+            try:
+                report = await profiling.profile(
+                    float(arguments.get("seconds", 5)),
+                    arguments.get("mode", "sample")
+                )
+            except (profiling.ProfilerBusy, ValueError) as e:
+                return tool_result({
+                    "success": False,
+                    "error": str(e)
+                })
+            return tool_result({
+                "success": True,
+                "mode": arguments.get("mode", "sample"),
+                "profile": truncate_text(report, PROFILE_OUTPUT_BYTES),
+                "loop": loop_monitor.stats()
+            })
         else:
-            return {
-                "content": [
-                    {
-                        "type": "text",
-                        "text": f"❌ Unknown tool: {name}"
-                    }
-                ]
-            }
+            return tool_result({
+                "success": False,
+                "error": f"Unknown tool: {name}"
+            })
     
     return server
 
@@ -247,12 +474,27 @@ async def run_mcp_server():
         print("❌ LEMON_EMAIL_API_KEY environment variable required")
         return
     
-    print(f"🚀 Starting {SERVER_NAME} MCP server v{SERVER_VERSION}...")
-    print("📡 Waiting for MCP client connection...")
-    print("💡 Press Ctrl+C to stop")
+    # stdout carries the JSON-RPC stream, so status output goes to stderr
+    print(f"🚀 Starting {SERVER_NAME} MCP server v{SERVER_VERSION}...", file=sys.stderr)
+    print("📡 Waiting for MCP client connection...", file=sys.stderr)
+    print("💡 Press Ctrl+C to stop", file=sys.stderr)
     
     try:
-        server = create_server()
+        email_server = LemonEmailServer()
+        server = create_server(email_server)
+        
+        # SIGTERM/SIGINT start a drain instead of killing in-flight sends
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass  # Not supported on this platform; default handling applies
+        
+        if loop_monitor:
+            loop_monitor.start()
+        await email_server.renderer.start()
         
         async with stdio_server() as (read_stream, write_stream):
             initialization_options = InitializationOptions(
@@ -264,16 +506,38 @@ async def run_mcp_server():
                 )
             )
             
-            await server.run(
+            serve = asyncio.create_task(server.run(
                 read_stream, 
                 write_stream, 
                 initialization_options
+            ))
+            stopped = asyncio.create_task(stop.wait())
+            await asyncio.wait({serve, stopped}, return_when=asyncio.FIRST_COMPLETED)
+            serve_error = serve.exception() if serve.done() and not serve.cancelled() else None
+            
+            # Drain while the transport is still up so finished sends get answered
+            print("\n🛑 Shutting down, draining in-flight sends...", file=sys.stderr)
+            report = await email_server.drain.drain()
+            print(
+                f"📦 Drained in {report['drain_seconds']}s: {report['completed']} completed, "
+                f"{report['abandoned']} abandoned"
+                + (f" (saved to {report['pending_file']})" if report["saved"] else ""),
+                file=sys.stderr
             )
             
+            for task in (serve, stopped):
+                task.cancel()
+            await asyncio.gather(serve, stopped, return_exceptions=True)
+            await email_server.aclose()
+            if loop_monitor:
+                await loop_monitor.stop()
+            if serve_error:
+                raise serve_error
+            
     except KeyboardInterrupt:
-        print("\n🛑 Server stopped by user")
+        print("\n🛑 Server stopped by user", file=sys.stderr)
     except Exception as e:
-        print(f"❌ Server error: {type(e).__name__}: {e}")
+        print(f"❌ Server error: {type(e).__name__}: {e}", file=sys.stderr)
         import traceback
         traceback.print_exc()
 
@@ -298,6 +562,8 @@ async def run_standalone_test():
             print(f"   Response: {result['response']}")
         else:
             print(f"❌ Email failed: {result['error']}")
+        
+        await email_server.aclose()
             
     except Exception as e:
         print(f"❌ Test error: {type(e).__name__}: {e}")
@@ -310,14 +576,28 @@ def print_usage():
     print("  python simple_mcp_server.py          # Start MCP server")
     print("  python simple_mcp_server.py test     # Run standalone test")
     print("  python simple_mcp_server.py help     # Show this help")
+    print("  --performance                        # Run on uvloop if installed")
     print("\nEnvironment:")
     print("  LEMON_EMAIL_API_KEY     Required API key")
     print("  LEMON_EMAIL_API_BASE_URL Optional base URL")
+    print("  LEMON_EMAIL_API_BASE_URLS Optional comma-separated failover base URLs")
+    print("  LEMON_EMAIL_API_IDEMPOTENCY Set to 1 if the API honours Idempotency-Key")
+    print("  LEMON_EMAIL_HEDGE_REQUESTS Set to 1 to hedge idempotent sends")
+    print("  LEMON_EMAIL_VALIDATE_RECIPIENTS Set to 1 to check recipients before sending")
+    print("  LEMON_EMAIL_RUNTIME      'performance' for the uvloop runtime")
+    print("  LEMON_EMAIL_DRAIN_TIMEOUT Seconds to let in-flight sends finish on shutdown")
+    print("  LEMON_EMAIL_ENABLE_PROFILING_TOOL Set to 1 to expose the profile_server tool")
+    print("  LEMON_EMAIL_RENDER_WORKERS Processes rendering plain/Markdown bodies (0 = inline)")
+    print("  LEMON_EMAIL_VALIDATOR    'pydantic' (default) or 'msgspec' for payload validation")
+    print("  LEMON_EMAIL_ATTACHMENT_DIR Directory the send_email tool may attach files from")
+    print("  LEMON_EMAIL_MAX_ATTACHMENT_MB Per-attachment size cap (default 25)")
+    print("  LEMON_EMAIL_GZIP_ATTACHMENTS Set to 1 to gzip request bodies with attachments")
 
 async def main():
     """Main entry point with better argument handling"""
-    if len(sys.argv) > 1:
-        command = sys.argv[1].lower()
+    args = runtime_mode.strip_runtime_flags(sys.argv[1:])
+    if args:
+        command = args[0].lower()
         
         if command == "test":
             await run_standalone_test()
@@ -330,4 +610,4 @@ async def main():
         await run_mcp_server()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    runtime_mode.run(main(), performance=runtime_mode.performance_mode_enabled())
\ No newline at end of file
@@ -0,0 +1,66 @@
+import time
+
+import pytest
+
+from api_key_cache import NegativeKeyCache, hash_api_key, rejects_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_rejections_expire_after_the_ttl(clock):
+    cache = NegativeKeyCache(ttl=60.0)
+    cache.reject("bad")
+    assert cache.is_rejected("bad")
+    clock[0] += 59.0
+    assert cache.is_rejected("bad")
+    clock[0] += 2.0
+    assert not cache.is_rejected("bad")
+    assert cache.stats()["entries"] == 0
+
+
+def test_oldest_rejections_are_evicted_first(clock):
+    cache = NegativeKeyCache(max_entries=2)
+    for key in ("a", "b", "c"):
+        cache.reject(key)
+    assert [cache.is_rejected(key) for key in ("a", "b", "c")] == [False, True, True]
+    # Rejecting again refreshes the entry's place
+    cache.reject("b")
+    cache.reject("d")
+    assert [cache.is_rejected(key) for key in ("b", "c", "d")] == [True, False, True]
+
+
+def test_hit_and_miss_counters_and_forget(clock):
+    cache = NegativeKeyCache()
+    assert not cache.is_rejected("k")
+    cache.reject("k")
+    assert cache.is_rejected("k") and cache.is_rejected("k")
+    cache.forget("k")
+    assert not cache.is_rejected("k")
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (2, 2, 0)
+
+
+def test_raw_keys_are_not_kept():
+    cache = NegativeKeyCache()
+    cache.reject("secret-key")
+    assert all(isinstance(digest, bytes) and b"secret" not in digest for digest in cache._entries)
+    assert hash_api_key("secret-key") == hash_api_key("secret-key") != "secret-key"
+
+
+@pytest.mark.parametrize("status, body, rejected", [
+    (401, None, True),
+    (401, {"error": "Unauthorized"}, True),
+    (403, {"error": "Invalid API key"}, True),
+    (403, "api key revoked", True),
+    (403, {"error": "Sender mail@example.com is not verified for this key"}, False),
+    (403, None, False),
+    (400, {"error": "invalid api key"}, False),
+    (500, None, False),
+])
+def test_only_key_failures_mark_the_key_bad(status, body, rejected):
+    assert rejects_key(status, body) is rejected
@@ -0,0 +1,48 @@
+import asyncio
+import base64
+import io
+import json
+import os
+
+import pytest
+
+from attachments import AttachmentError, AttachmentSource, request_body
+from json_codec import codec
+
+
+async def collect(body) -> bytes:
+    return b"".join([chunk async for chunk in body()])
+
+
+@pytest.mark.asyncio
+async def test_concurrent_attempts_stream_an_upload_independently():
+    data = os.urandom(500 * 1024)
+    upload = AttachmentSource.from_fileobj(io.BytesIO(data), "upload.bin")
+    body = request_body(codec.dumps({"to": "a@example.com"}), [upload], codec.dumps, gzip=False)
+
+    # Two hedged attempts reading the same upload at once
+    first, second = await asyncio.gather(collect(body), collect(body))
+
+    for raw in (first, second):
+        content = json.loads(raw)["attachments"][0]["content"]
+        assert base64.b64decode(content) == data
+
+
+def test_paths_are_confined_to_the_attachment_directory(tmp_path):
+    root = tmp_path / "attachments"
+    root.mkdir()
+    (root / "report.txt").write_text("ok")
+    (tmp_path / "secret.txt").write_text("no")
+    os.symlink(tmp_path / "secret.txt", root / "link.txt")
+
+    assert AttachmentSource.from_spec({"path": "report.txt"}, root=str(root)).filename == "report.txt"
+    assert AttachmentSource.from_spec({"url": f"file://{root}/report.txt"}, root=str(root)).size == 2
+    for path in (str(tmp_path / "secret.txt"), "../secret.txt", "link.txt"):
+        with pytest.raises(AttachmentError):
+            AttachmentSource.from_spec({"path": path}, root=str(root))
+
+
+def test_path_attachments_are_disabled_without_a_directory(tmp_path):
+    (tmp_path / "report.txt").write_text("ok")
+    with pytest.raises(AttachmentError, match="disabled"):
+        AttachmentSource.from_spec({"path": str(tmp_path / "report.txt")}, root=None)
@@ -0,0 +1,110 @@
+import os
+
+from backlog import CompactBacklog, InternPool
+
+
+def payload(i, body="<p>Campaign body</p>"):
+    return {
+        "to": f"user{i}@example.com",
+        "subject": "Spring sale",
+        "body": body,
+        "fromname": "Shop",
+        "fromemail": "shop@example.com",
+        "toname": f"User {i}",
+        "tag": "spring",
+        "variables": {"coupon": f"C{i:04d}"} if i % 2 else None,
+        "replyto": "help@example.com" if i % 3 == 0 else None,
+        "body_format": "markdown" if i % 5 == 0 else None,
+    }
+
+
+def test_intern_pool_shares_and_frees_strings_by_refcount():
+    pool = InternPool()
+    a = pool.intern("hello")
+    assert pool.intern("hello") == a
+    b = pool.intern("world")
+    assert (len(pool), pool.get(a), pool.digest(a) != pool.digest(b)) == (2, "hello", True)
+    pool.release(a)
+    assert pool.get(a) == "hello"
+    pool.release(a)
+    assert len(pool) == 1
+    # Freed slots are reused
+    assert pool.intern("again") == a
+    pool.release(a)
+    pool.release(b)
+    assert (len(pool), pool.bytes) == (0, 0)
+
+
+def test_fifo_round_trip_across_memory_and_spilled_segments(tmp_path):
+    backlog = CompactBacklog(memory_budget=4096, spill_dir=str(tmp_path), segment_bytes=2048)
+    for i in range(200):
+        backlog.push(payload(i), f"key-{i % 3}")
+    stats = backlog.stats()
+    assert len(backlog) == 200 and backlog.spilled > 0
+    assert stats["in_memory"] > 0 and stats["segments"] > 1
+    assert len(os.listdir(tmp_path)) == stats["segments"]
+
+    for i in range(200):
+        popped, api_key = backlog.pop()
+        assert popped == payload(i) and api_key == f"key-{i % 3}"
+    assert backlog.pop() is None
+    assert os.listdir(tmp_path) == []
+    assert (len(backlog.pool), backlog.pool.bytes) == (0, 0)
+
+
+def test_shared_fields_are_interned_once():
+    backlog = CompactBacklog()
+    for i in range(100):
+        backlog.push(payload(i, body="x" * 10000), "key")
+    # subject, body, fromname, tag, two body formats ("" and "markdown") and the key
+    assert backlog.stats()["interned_strings"] == 7
+    assert backlog.stats()["memory_bytes"] < 100 * 10000
+
+
+def test_drain_records_write_shared_fields_once_and_hash_keys(tmp_path):
+    backlog = CompactBacklog(memory_budget=4096, spill_dir=str(tmp_path), segment_bytes=2048)
+    for i in range(50):
+        backlog.push(payload(i), "secret-key")
+    records = list(backlog.drain_records(lambda key: f"hash({key})"))
+
+    shared = {record["shared"]: record["value"] for record in records if "shared" in record}
+    sends = [record for record in records if "shared" not in record]
+    assert len(shared) == len([record for record in records if "shared" in record])
+    assert [send["to"] for send in sends] == [f"user{i}@example.com" for i in range(50)]
+    for i, send in enumerate(sends):
+        expected = payload(i)
+        assert shared[send["body_ref"]] == expected["body"]
+        assert shared[send["subject_ref"]] == expected["subject"]
+        assert (shared[send["body_format_ref"]] or None) == expected["body_format"]
+        assert send["variables"] == expected["variables"] and send["replyto"] == expected["replyto"]
+        assert send["api_key_sha256"] == "hash(secret-key)"
+    assert "secret-key" not in shared.values()
+    # Every shared line precedes the first record that points at it
+    seen = set()
+    for record in records:
+        if "shared" in record:
+            seen.add(record["shared"])
+        else:
+            assert {record[f"{field}_ref"] for field in ("subject", "body", "fromname", "tag")} <= seen
+    assert len(backlog) == 0 and os.listdir(tmp_path) == [] and len(backlog.pool) == 0
+
+
+def test_clear_removes_spill_files(tmp_path):
+    backlog = CompactBacklog(memory_budget=0, spill_dir=str(tmp_path))
+    for i in range(10):
+        backlog.push(payload(i), "key")
+    assert os.listdir(tmp_path)
+    backlog.clear()
+    assert len(backlog) == 0 and os.listdir(tmp_path) == []
+
+
+def test_personalised_backlog_stays_within_the_memory_budget(tmp_path):
+    budget = 1024 * 1024
+    backlog = CompactBacklog(memory_budget=budget, spill_dir=str(tmp_path))
+    for i in range(20000):
+        backlog.push(payload(i, body=f"<p>Hi user {i}</p>" + "x" * 2048), "key")
+    assert backlog.stats()["memory_bytes"] <= budget
+    for i in range(20000):
+        popped, _ = backlog.pop()
+        assert popped["body"].startswith(f"<p>Hi user {i}</p>")
+    assert backlog.pop() is None and len(backlog.pool) == 0
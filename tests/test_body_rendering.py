@@ -0,0 +1,27 @@
+from body_rendering import inline_html, inline_text, render_body
+
+
+def test_emphasis_markers_inside_link_urls_are_left_alone():
+    html = inline_html("[x](https://x.com/_private_/y) and [**y**](https://a.com/**b**/c)")
+    assert 'href="https://x.com/_private_/y"' in html
+    assert 'href="https://a.com/**b**/c"' in html
+    assert "<em>" not in html
+    assert "<strong>y</strong></a>" in html
+
+
+def test_links_and_code_survive_in_the_text_alternative():
+    text = inline_text("[x](https://x.com/_private_/y) `a_b_` *em*")
+    assert text == "x (https://x.com/_private_/y) a_b_ em"
+
+
+def test_unsafe_links_become_plain_labels():
+    html = inline_html("[click](javascript:alert) **now**")
+    assert "<a" not in html
+    assert html == "click <strong>now</strong>"
+
+
+def test_markdown_render_escapes_and_keeps_code_literal():
+    rendered = render_body("# Hi <b>\n\nUse `**raw**` and __bold__", "markdown")
+    assert "&lt;b&gt;" in rendered["html"]
+    assert "**raw**</code>" in rendered["html"]
+    assert "<strong>bold</strong>" in rendered["html"]
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from fair_scheduler import FairScheduler, TenantQueueFull, parse_weights
+
+
+def job(order, name, gate=None):
+    async def run():
+        order.append(name)
+        if gate is not None:
+            await gate.wait()
+        return name
+    return run
+
+
+async def run_queued(scheduler, jobs):
+    """Hold the single slot while ``jobs`` are queued, then let them run in DRR order"""
+    order, gate = [], asyncio.Event()
+    blocker = scheduler.enqueue("blocker", job([], "blocker", gate))
+    futures = [scheduler.enqueue(tenant, job(order, f"{tenant}{i}")) for i, tenant in enumerate(jobs)]
+    gate.set()
+    await blocker
+    await asyncio.gather(*futures)
+    return [name.rstrip("0123456789") for name in order]
+
+
+@pytest.mark.asyncio
+async def test_equal_weights_alternate_between_tenants():
+    scheduler = FairScheduler(concurrency=1)
+    order = await run_queued(scheduler, ["a"] * 4 + ["b"] * 2)
+    assert order == ["a", "b", "a", "b", "a", "a"]
+
+
+@pytest.mark.asyncio
+async def test_weights_set_each_tenants_share():
+    scheduler = FairScheduler(concurrency=1, weights={"a": 2.0, "c": 0.5})
+    order = await run_queued(scheduler, ["a"] * 6 + ["b"] * 3 + ["c"] * 2)
+    # Per round a sends two, b one and c one every other round
+    assert order == ["a", "a", "b", "a", "a", "b", "c", "a", "a", "b", "c"]
+
+
+def test_weights_match_the_longest_key_hash_prefix():
+    assert parse_weights("ab=2, abc=5,zz=0") == {"ab": 2.0, "abc": 5.0, "zz": 0.01}
+    scheduler = FairScheduler(weights=parse_weights("ab=2,abc=5"), default_weight=1.5)
+    assert scheduler.weight_for("abcdef") == 5.0
+    assert scheduler.weight_for("abxyz") == 2.0
+    assert scheduler.weight_for("ffff") == 1.5
+
+
+@pytest.mark.asyncio
+async def test_concurrency_limit_and_per_tenant_queue_limit():
+    gate = asyncio.Event()
+    started = []
+    scheduler = FairScheduler(concurrency=2, max_queue_per_tenant=2)
+    futures = [scheduler.enqueue("t", job(started, i, gate)) for i in range(4)]
+    with pytest.raises(TenantQueueFull):
+        scheduler.enqueue("t", job(started, 4, gate))
+    await asyncio.sleep(0)
+    assert (scheduler.running, scheduler.queued, started) == (2, 2, [0, 1])
+    gate.set()
+    assert await asyncio.gather(*futures) == [0, 1, 2, 3]
+    assert (scheduler.running, scheduler.queued) == (0, 0)
+
+
+@pytest.mark.asyncio
+async def test_close_fails_queued_jobs_and_returns_their_records():
+    gate = asyncio.Event()
+    scheduler = FairScheduler(concurrency=1)
+    running = scheduler.enqueue("a", job([], "running", gate), {"to": "running@example.com"})
+    queued = [
+        scheduler.enqueue("a", job([], "a1"), {"to": "a1@example.com"}),
+        scheduler.enqueue("b", job([], "b1"), {"to": "b1@example.com"}),
+        scheduler.enqueue("b", job([], "b2")),
+    ]
+    records = scheduler.close(RuntimeError("shutting down"))
+    assert sorted(record["to"] for record in records) == ["a1@example.com", "b1@example.com"]
+    for future in queued:
+        with pytest.raises(RuntimeError, match="shutting down"):
+            await future
+    with pytest.raises(RuntimeError):
+        scheduler.enqueue("a", job([], "late"))
+    # Work already started is left to finish
+    gate.set()
+    assert await running == "running"
@@ -0,0 +1,50 @@
+import pytest
+
+pytest.importorskip("mcp")
+
+from mcp.types import CallToolRequest, CallToolRequestParams
+
+from simple_mcp_server import LemonEmailServer, create_server
+
+VALID = {"to": "a@example.com", "subject": "Hi", "body": "Hello", "fromemail": "me@example.com"}
+
+
+async def call(server, name, arguments):
+    handler = server.request_handlers[CallToolRequest]
+    response = await handler(CallToolRequest(method="tools/call", params=CallToolRequestParams(name=name, arguments=arguments)))
+    return response.root
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setenv("LEMON_EMAIL_API_KEY", "test-key")
+    email_server = LemonEmailServer()
+
+    async def send_email(**kwargs):
+        if kwargs["to"] == "bounce@example.com":
+            return {"success": False, "status_code": 400, "error": "API error 400: rejected"}
+        return {"success": True, "status_code": 200, "response": {"id": "m-1"}}
+
+    monkeypatch.setattr(email_server, "send_email", send_email)
+    return create_server(email_server)
+
+
+@pytest.mark.asyncio
+async def test_successful_sends_are_not_errors(server):
+    result = await call(server, "send_email", VALID)
+    assert not result.isError
+    assert result.structuredContent == {"success": True, "status_code": 200, "message_id": "m-1"}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("name, arguments, error", [
+    ("send_email", {**VALID, "to": "bounce@example.com"}, "API error 400"),
+    ("send_email", {**VALID, "attachments": [{"path": "/etc/passwd"}]}, "ttachment"),
+    ("no_such_tool", {}, "Unknown tool"),
+])
+async def test_failures_are_flagged_and_keep_structured_content(server, name, arguments, error):
+    result = await call(server, name, arguments)
+    assert result.isError
+    assert result.structuredContent["success"] is False
+    assert error in result.structuredContent["error"]
+    assert result.content[0].text.startswith('{"success":false')
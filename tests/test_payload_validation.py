@@ -0,0 +1,50 @@
+import pytest
+
+from payload_validation import VALIDATORS, EmailPayload, PayloadError, ToolEmailPayload
+
+VALID = {"to": "a@example.com", "subject": "Hi", "body": "Hello", "fromemail": "me@example.com"}
+
+
+@pytest.mark.parametrize("name", sorted(VALIDATORS))
+def test_errors_are_structured_like_pydantic(name):
+    validator = VALIDATORS[name]
+    with pytest.raises(PayloadError) as missing:
+        validator.validate({"to": "a@example.com", "subject": "Hi", "body": "Hello"})
+    assert missing.value.details == [{
+        "type": "missing",
+        "loc": ["fromemail"],
+        "msg": "Field required",
+        "input": {"to": "a@example.com", "subject": "Hi", "body": "Hello"},
+    }]
+
+    with pytest.raises(PayloadError) as nested:
+        validator.validate({**VALID, "attachments": [{"path": 1}]}, ToolEmailPayload)
+    [detail] = nested.value.details
+    assert set(detail) == {"type", "loc", "msg", "input"}
+    assert (detail["loc"], detail["input"]) == (["attachments", 0, "path"], 1)
+    assert nested.value.errors[0].startswith("attachments.0.path: ")
+
+
+@pytest.mark.parametrize("name", sorted(VALIDATORS))
+def test_batches_report_each_bad_message(name):
+    results, errors = VALIDATORS[name].validate_many([VALID, {**VALID, "to": ""}, "nope"], EmailPayload)
+    assert results[0] == VALID and results[1] is None and results[2] is None
+    assert sorted(errors) == [1, 2]
+    assert errors[1][0].startswith("to: ")
+
+
+def test_web_422_bodies_keep_fastapis_error_format():
+    from fastapi.testclient import TestClient
+
+    import web_server
+
+    client = TestClient(web_server.app)
+    response = client.post("/send-email", json={**VALID, "api_key": "k", "variables": 5})
+    assert response.status_code == 422
+    [detail] = response.json()["detail"]
+    assert detail["loc"] == ["body", "variables"] and detail["input"] == 5
+    assert set(detail) == {"type", "loc", "msg", "input"}
+
+    response = client.post("/send-email", content=b"{not json", headers={"content-type": "application/json"})
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["type"] == "json_invalid"
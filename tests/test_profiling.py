@@ -0,0 +1,88 @@
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import profiling
+import web_server
+
+
+def stall(seconds):
+    time.sleep(seconds)
+
+
+async def block_loop_soon(seconds, delay=0.05):
+    await asyncio.sleep(delay)
+    stall(seconds)
+
+
+@pytest.mark.asyncio
+async def test_sampling_profile_sees_what_blocks_the_loop():
+    report, _ = await asyncio.gather(profiling.profile(0.3, "sample"), block_loop_soon(0.15))
+    assert "test_profiling.py:stall:" in report
+    # Collapsed stacks: "frame;frame;... count"
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in report.splitlines())
+
+
+@pytest.mark.asyncio
+async def test_cprofile_report_and_mode_validation():
+    report, _ = await asyncio.gather(profiling.profile(0.2, "cprofile"), block_loop_soon(0.05))
+    assert "function calls" in report and "stall" in report
+    with pytest.raises(ValueError):
+        await profiling.profile(0.1, "perf")
+
+
+@pytest.mark.asyncio
+async def test_only_one_profile_runs_at_a_time():
+    first = asyncio.ensure_future(profiling.profile(0.2))
+    await asyncio.sleep(0.01)
+    with pytest.raises(profiling.ProfilerBusy):
+        await profiling.profile(0.1)
+    await first
+    assert isinstance(await profiling.profile(0.1), str)
+
+
+@pytest.mark.asyncio
+async def test_loop_monitor_records_lag_and_slow_callbacks_with_stacks():
+    monitor = profiling.LoopMonitor(interval=0.02, slow_threshold=0.05)
+    monitor.start()
+    try:
+        await asyncio.sleep(0.1)
+        stall(0.25)
+        await asyncio.sleep(0.1)
+        stats = monitor.stats()
+    finally:
+        await monitor.stop()
+
+    assert stats["running"] and stats["samples"] > 0
+    assert stats["lag_max_ms"] >= 150
+    [slow] = stats["slow_callbacks"]
+    assert slow["blocked_ms"] >= 50
+    assert any(":stall:" in entry for entry in slow["stack"])
+    assert not monitor.stats()["running"]
+
+
+@pytest.mark.parametrize("path", ["/debug/profile?seconds=0.1", "/debug/loop"])
+def test_debug_endpoints_are_hidden_without_a_token(monkeypatch, path):
+    monkeypatch.setattr(web_server, "DEBUG_TOKEN", None)
+    client = TestClient(web_server.app)
+    assert client.get(path).status_code == 404
+    assert client.get(path, headers={"X-Debug-Token": "anything"}).status_code == 404
+
+
+@pytest.mark.parametrize("path", ["/debug/profile?seconds=0.1", "/debug/loop"])
+def test_debug_endpoints_need_the_right_token(monkeypatch, path):
+    monkeypatch.setattr(web_server, "DEBUG_TOKEN", "s3cret")
+    client = TestClient(web_server.app)
+    assert client.get(path).status_code == 401
+    assert client.get(path, headers={"X-Debug-Token": "wrong"}).status_code == 401
+
+
+def test_debug_profile_with_the_token(monkeypatch):
+    monkeypatch.setattr(web_server, "DEBUG_TOKEN", "s3cret")
+    client = TestClient(web_server.app)
+    response = client.get("/debug/profile", params={"seconds": 0.1, "mode": "cprofile"}, headers={"X-Debug-Token": "s3cret"})
+    assert response.status_code == 200
+    assert "function calls" in response.text
+    assert client.get("/debug/profile", params={"mode": "perf"}, headers={"X-Debug-Token": "s3cret"}).status_code == 422
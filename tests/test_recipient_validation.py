@@ -0,0 +1,28 @@
+import pytest
+
+from recipient_validation import RecipientValidator
+
+
+@pytest.mark.asyncio
+async def test_resolver_failures_fail_open_and_are_not_cached():
+    async def broken(domain):
+        raise OSError("resolver unavailable")
+
+    validator = RecipientValidator(resolver=broken)
+    assert await validator.validate("user@example.com") is None
+    assert await validator.validate("user@example.com") is None
+    assert validator.lookups == 2
+
+
+@pytest.mark.asyncio
+async def test_domains_without_mail_are_rejected_and_cached():
+    async def no_mail(domain):
+        return []
+
+    validator = RecipientValidator(resolver=no_mail)
+    results = await validator.validate_many(["a@nomail.test", "b@nomail.test", "bad@", "x@mailinator.com"])
+    assert results["a@nomail.test"] == results["b@nomail.test"] == "domain does not accept email (no MX or address records)"
+    assert results["bad@"] == "malformed address"
+    assert results["x@mailinator.com"] == "disposable email domain"
+    await validator.validate("c@nomail.test")
+    assert validator.lookups == 1
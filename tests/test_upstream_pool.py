@@ -0,0 +1,154 @@
+import asyncio
+import time
+
+import pytest
+
+from upstream_pool import UpstreamPool
+
+
+class Response:
+    def __init__(self, status_code: int = 200):
+        self.status_code = status_code
+
+
+class Unreachable(Exception):
+    pass
+
+
+def pool_of(*urls, **kwargs) -> UpstreamPool:
+    return UpstreamPool(list(urls), retryable=(Unreachable,), **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_connection_errors_and_gateway_responses_fail_over():
+    pool = pool_of("https://a", "https://b", "https://c")
+    calls = []
+
+    async def send(base_url):
+        calls.append(base_url)
+        if base_url == "https://a":
+            raise Unreachable()
+        if base_url == "https://b":
+            return Response(503)
+        return Response(200)
+
+    response, base_url = await pool.request(send)
+    assert (response.status_code, base_url) == (200, "https://c")
+    assert calls == ["https://a", "https://b", "https://c"]
+
+
+@pytest.mark.asyncio
+async def test_non_idempotent_sends_are_not_retried_after_reaching_the_api():
+    pool = pool_of("https://a", "https://b")
+    calls = []
+
+    async def send(base_url):
+        calls.append(base_url)
+        return Response(500)
+
+    response, base_url = await pool.request(send)
+    assert (response.status_code, base_url) == (500, "https://a")
+    assert calls == ["https://a"]
+
+    async def timeout(base_url):
+        calls.append(base_url)
+        raise TimeoutError()
+
+    with pytest.raises(TimeoutError):
+        await pool.request(timeout)
+
+
+@pytest.mark.asyncio
+async def test_hedged_request_wins_on_the_secondary_and_cancels_the_primary():
+    pool = pool_of("https://slow", "https://fast", hedge=True, hedge_delay=0.02, hedge_min_delay=0.01)
+    cancelled = []
+
+    async def send(base_url):
+        if base_url == "https://slow":
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                cancelled.append(base_url)
+                raise
+        return Response(200)
+
+    response, base_url = await pool.request(send, idempotent=True)
+    assert base_url == "https://fast"
+    await asyncio.sleep(0)
+    assert cancelled == ["https://slow"]
+    slow, fast = pool.endpoints
+    # The cancelled loser is not counted against its endpoint
+    assert (slow.requests, slow.failures, fast.requests) == (0, 0, 1)
+
+
+def test_repeated_failures_put_an_endpoint_in_cooldown():
+    pool = pool_of("https://a", "https://b")
+    a, b = pool.endpoints
+    for _ in range(pool.failure_threshold):
+        a.record(0.01, False, pool.failure_threshold, pool.cooldown)
+    assert not a.is_healthy()
+    assert pool.ranked() == [b, a]
+
+
+def clocked_send(clock, latencies, calls):
+    async def send(base_url):
+        calls.append(base_url)
+        clock[0] += latencies[base_url]
+        return Response(200)
+    return send
+
+
+@pytest.mark.asyncio
+async def test_sparse_traffic_stays_on_the_fast_endpoint(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: clock[0])
+    pool = pool_of("https://fast", "https://slow", half_life=30.0)
+    calls = []
+    send = clocked_send(clock, {"https://fast": 0.050, "https://slow": 0.500}, calls)
+
+    # Both get probed once while unmeasured, then sends are two minutes apart
+    for _ in range(100):
+        await pool.request(send)
+        clock[0] += 120.0
+    assert calls.count("https://slow") == 1
+
+
+@pytest.mark.asyncio
+async def test_stale_competitive_endpoints_are_reprobed_occasionally(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: clock[0])
+    pool = pool_of("https://a", "https://b", half_life=30.0, probe_every=20)
+    calls = []
+    latencies = {"https://a": 0.050, "https://b": 0.080}
+    send = clocked_send(clock, latencies, calls)
+
+    for _ in range(100):
+        await pool.request(send)
+        clock[0] += 120.0
+    # One probe per 20 requests, beyond the initial measurement
+    assert calls.count("https://b") == 1 + 100 // 20
+
+    # A probe that finds b now faster moves traffic over to it
+    latencies["https://b"] = 0.010
+    calls.clear()
+    for _ in range(40):
+        await pool.request(send)
+        clock[0] += 120.0
+    assert calls[-10:] == ["https://b"] * 10
+
+
+def test_recent_stats_are_not_stale(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: clock[0])
+    pool = pool_of("https://a", "https://b", half_life=10.0, probe_every=1)
+    a, b = pool.endpoints
+    a.record(0.050, True)
+    b.record(0.060, True)
+    assert pool.ranked(explore=True)[0] is a
+    clock[0] += 11.0
+    assert b.is_stale() and pool.ranked(explore=True)[0] is b
+
+    # One fresh sample after a long gap outweighs the stale estimate
+    clock[0] += 30.0
+    b.record(0.500, True)
+    assert b.latency_ewma > 0.4
@@ -0,0 +1,25 @@
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import web_server
+
+VALID = {"to": "a@example.com", "subject": "Hi", "body": "Hello", "fromemail": "me@example.com", "api_key": "k"}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    def reply(request):
+        return httpx.Response(200, json={"id": "m-1", "message": "queued"})
+
+    monkeypatch.setattr(web_server, "_http_client", httpx.AsyncClient(transport=httpx.MockTransport(reply)))
+    return TestClient(web_server.app)
+
+
+def test_send_email_returns_the_upstream_reply_as_text(client):
+    response = client.post("/send-email", json=VALID)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["success"] is True
+    assert isinstance(body["response"], str)
+    assert '"id":"m-1"' in body["response"]
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Upstream endpoint pool for the Lemon Email API
+Tracks latency and error rate per base URL, picks the best healthy endpoint
+and fails over (or hedges) when an endpoint misbehaves
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, Type
+
+DEFAULT_API_BASE_URL = "https://app.xn--lemn-sqa.com/api"
+
+# Gateway errors mean the request never reached the mail pipeline, so they are
+# safe to retry elsewhere even without an idempotency key
+GATEWAY_ERRORS = {502, 503, 504}
+
+
+class EndpointHealth:
+    """Latency EWMA, error-rate EWMA and recent latency window for one base URL
+
+    Statistics go stale once an endpoint stops getting traffic: after
+    ``half_life`` idle seconds it becomes eligible for an occasional probe
+    (see ``UpstreamPool.ranked``), and the first sample after a quiet spell
+    carries correspondingly more weight.
+    """
+
+    def __init__(self, base_url: str, alpha: float = 0.05, window: int = 128, half_life: float = 30.0):
+        self.base_url = base_url.rstrip("/")
+        self.alpha = alpha
+        self.half_life = half_life
+        self.last_sample = 0.0
+        self.latency_ewma: Optional[float] = None
+        self.error_rate = 0.0
+        self.samples: Deque[float] = deque(maxlen=window)
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+
+    def record(self, latency: float, ok: bool, failure_threshold: int = 3, cooldown: float = 10.0):
+        """Fold one request outcome into the health statistics"""
+        now = time.monotonic()
+        self.requests += 1
+        alpha = 1.0 - (1.0 - self.alpha) * self.freshness(now)
+        self.last_sample = now
+        if self.latency_ewma is None:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma += alpha * (latency - self.latency_ewma)
+        self.error_rate += alpha * ((0.0 if ok else 1.0) - self.error_rate)
+
+        if ok:
+            self.samples.append(latency)
+            self.consecutive_failures = 0
+            self.cooldown_until = 0.0
+        else:
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= failure_threshold:
+                # Back off exponentially while the endpoint keeps failing
+                backoff = cooldown * 2 ** min(self.consecutive_failures - failure_threshold, 5)
+                self.cooldown_until = now + backoff
+
+    def is_healthy(self, now: Optional[float] = None) -> bool:
+        return (now if now is not None else time.monotonic()) >= self.cooldown_until
+
+    def p95(self) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    def freshness(self, now: Optional[float] = None) -> float:
+        """1.0 right after a sample, halving every ``half_life`` seconds without one"""
+        if self.latency_ewma is None or self.half_life <= 0:
+            return 1.0
+        idle = (now if now is not None else time.monotonic()) - self.last_sample
+        return 0.5 ** (max(idle, 0.0) / self.half_life)
+
+    def is_stale(self, now: Optional[float] = None) -> bool:
+        return self.latency_ewma is not None and self.freshness(now) <= 0.5
+
+    def score(self) -> float:
+        """Lower is better; unprobed endpoints score 0 so they get explored"""
+        if self.latency_ewma is None:
+            return 0.0
+        return self.latency_ewma * (1.0 + 10.0 * self.error_rate)
+
+    def snapshot(self) -> Dict[str, Any]:
+        p95 = self.p95()
+        return {
+            "base_url": self.base_url,
+            "healthy": self.is_healthy(),
+            "latency_ewma_ms": round(self.latency_ewma * 1000, 2) if self.latency_ewma is not None else None,
+            "latency_p95_ms": round(p95 * 1000, 2) if p95 is not None else None,
+            "error_rate": round(self.error_rate, 4),
+            "requests": self.requests,
+            "failures": self.failures,
+        }
+
+
+class UpstreamPool:
+    """Latency-aware selection and failover across several upstream base URLs"""
+
+    def __init__(
+        self,
+        base_urls: List[str],
+        hedge: bool = False,
+        hedge_delay: float = 1.0,
+        hedge_min_delay: float = 0.05,
+        failure_threshold: int = 3,
+        cooldown: float = 10.0,
+        max_attempts: Optional[int] = None,
+        retryable: Tuple[Type[BaseException], ...] = (),
+        half_life: float = 30.0,
+        probe_every: int = 20,
+        probe_margin: float = 2.0,
+    ):
+        if not base_urls:
+            raise ValueError("At least one upstream base URL is required")
+        self.endpoints = [EndpointHealth(url, half_life=half_life) for url in base_urls]
+        self.hedge = hedge
+        self.hedge_delay = hedge_delay
+        self.hedge_min_delay = hedge_min_delay
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_attempts = max_attempts or len(self.endpoints)
+        self.retryable = retryable
+        # Re-probing is bounded: at most one request in ``probe_every`` goes to
+        # a stale endpoint, and only if it last scored within ``probe_margin``
+        # times the best, so sparse traffic never alternates onto a slow one
+        self.probe_every = probe_every
+        self.probe_margin = probe_margin
+        self._since_probe = 0
+
+    @classmethod
+    def from_env(cls, retryable: Tuple[Type[BaseException], ...] = ()) -> "UpstreamPool":
+        """Build a pool from LEMON_EMAIL_API_BASE_URLS (or LEMON_EMAIL_API_BASE_URL)"""
+        raw = os.getenv("LEMON_EMAIL_API_BASE_URLS") or os.getenv("LEMON_EMAIL_API_BASE_URL", DEFAULT_API_BASE_URL)
+        base_urls = [url.strip() for url in raw.split(",") if url.strip()]
+        return cls(
+            base_urls or [DEFAULT_API_BASE_URL],
+            hedge=os.getenv("LEMON_EMAIL_HEDGE_REQUESTS", "").lower() in ("1", "true", "yes"),
+            hedge_min_delay=float(os.getenv("LEMON_EMAIL_HEDGE_MIN_DELAY_MS", "50")) / 1000,
+            retryable=retryable,
+            half_life=float(os.getenv("LEMON_EMAIL_UPSTREAM_STATS_HALF_LIFE", "30")),
+        )
+
+    @property
+    def primary_url(self) -> str:
+        return self.endpoints[0].base_url
+
+    def url_map(self, path: str) -> Dict[str, str]:
+        """Full URL for ``path`` on every endpoint, built once instead of per send"""
+        return {ep.base_url: f"{ep.base_url}{path}" for ep in self.endpoints}
+
+    def ranked(self, explore: bool = False) -> List[EndpointHealth]:
+        """Healthy endpoints by score, then cooling-down ones by earliest recovery
+
+        With ``explore`` (one call per request) a stale but competitive
+        endpoint is occasionally moved to the front to refresh its stats.
+        """
+        now = time.monotonic()
+        healthy = [ep for ep in self.endpoints if ep.is_healthy(now)]
+        cooling = [ep for ep in self.endpoints if not ep.is_healthy(now)]
+        healthy.sort(key=lambda ep: ep.score())
+        cooling.sort(key=lambda ep: ep.cooldown_until)
+        if explore and len(healthy) > 1:
+            self._since_probe += 1
+            if self._since_probe >= self.probe_every:
+                limit = healthy[0].score() * self.probe_margin
+                for index, ep in enumerate(healthy[1:], 1):
+                    if ep.is_stale(now) and ep.score() <= limit:
+                        self._since_probe = 0
+                        healthy.insert(0, healthy.pop(index))
+                        break
+        return healthy + cooling
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        return [ep.snapshot() for ep in self.endpoints]
+
+    def _is_server_error(self, response: Any, idempotent: bool) -> bool:
+        status = getattr(response, "status_code", 200)
+        if idempotent:
+            return status >= 500
+        return status in GATEWAY_ERRORS
+
+    async def _attempt(self, send: Callable[[str], Awaitable[Any]], endpoint: EndpointHealth, idempotent: bool):
+        start = time.monotonic()
+        try:
+            response = await send(endpoint.base_url)
+        except asyncio.CancelledError:
+            # Hedging losers are cancelled on purpose, not an endpoint failure
+            raise
+        except Exception:
+            endpoint.record(time.monotonic() - start, False, self.failure_threshold, self.cooldown)
+            raise
+        ok = getattr(response, "status_code", 200) < 500
+        endpoint.record(time.monotonic() - start, ok, self.failure_threshold, self.cooldown)
+        return response, endpoint
+
+    async def _race(self, send, group: List[EndpointHealth], idempotent: bool):
+        """Send to the first endpoint, hedging to the second after its p95 latency"""
+        if len(group) == 1:
+            return await self._attempt(send, group[0], idempotent)
+
+        primary, secondary = group
+        delay = max(primary.p95() or self.hedge_delay, self.hedge_min_delay)
+        pending = {asyncio.ensure_future(self._attempt(send, primary, idempotent))}
+        hedged = False
+        fallback = None
+        last_error: Optional[BaseException] = None
+
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=None if hedged else delay,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    if task.exception() is not None:
+                        last_error = task.exception()
+                        continue
+                    response, endpoint = task.result()
+                    if not self._is_server_error(response, idempotent):
+                        return response, endpoint
+                    fallback = (response, endpoint)
+                if not hedged:
+                    hedged = True
+                    pending.add(asyncio.ensure_future(self._attempt(send, secondary, idempotent)))
+        finally:
+            for task in pending:
+                task.cancel()
+
+        if fallback is not None:
+            return fallback
+        raise last_error
+
+    async def request(self, send: Callable[[str], Awaitable[Any]], idempotent: bool = False) -> Tuple[Any, str]:
+        """Run ``send(base_url)`` against the best endpoint, failing over on errors
+
+        Returns the response together with the base URL that produced it.
+        Without an idempotency guarantee only connection-level errors and
+        gateway responses are retried, so an email is never sent twice.
+        """
+        candidates = self.ranked(explore=True)[: self.max_attempts]
+        step = 2 if (self.hedge and idempotent) else 1
+        fallback = None
+        last_error: Optional[BaseException] = None
+
+        for i in range(0, len(candidates), step):
+            try:
+                response, endpoint = await self._race(send, candidates[i:i + step], idempotent)
+            except Exception as e:
+                last_error = e
+                if idempotent or isinstance(e, self.retryable):
+                    continue
+                raise
+            if not self._is_server_error(response, idempotent):
+                return response, endpoint.base_url
+            fallback = (response, endpoint.base_url)
+
+        if fallback is not None:
+            return fallback
+        raise last_error
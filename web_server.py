@@ -5,20 +5,96 @@ This creates a simple web interface and health endpoint for Railway
 """
 
 import asyncio
+import hmac
 import json
+import math
 import os
 import threading
-from fastapi import FastAPI, HTTPException, BackgroundTasks
-from fastapi.responses import HTMLResponse, JSONResponse
-from pydantic import BaseModel
-from typing import Optional, Dict, Any
+import time
+import uuid
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends, File, Form, Header, Query, Request, UploadFile
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
+from typing import Optional, Dict, Any, List
 import uvicorn
 import httpx
 
+from api_key_cache import REJECTED_STATUSES, NegativeKeyCache, hash_api_key, rejects_key
+import attachments as attachment_streams
+from attachments import AttachmentError, AttachmentSource
+from backlog import CompactBacklog
+from body_rendering import TEXT_BODY_FIELD, BodyRenderer
+from fair_scheduler import FairScheduler, TenantQueueFull
+from json_codec import codec
+from payload_validation import (
+    BulkEmailEnvelope,
+    EmailPayload,
+    PayloadError,
+    SendEmailRequest,
+    error_detail,
+    json_schema,
+    validator,
+)
+import profiling
+from recipient_validation import RecipientValidator
+import runtime_mode
+from shutdown import DrainController, ShuttingDown, pending_record
+from upstream_pool import UpstreamPool
+
+# Shared across requests so endpoint health survives per-request server instances
+upstream = UpstreamPool.from_env(retryable=(httpx.ConnectError, httpx.ConnectTimeout))
+# Only set when the upstream honours Idempotency-Key; enables hedging
+API_IDEMPOTENCY = os.getenv("LEMON_EMAIL_API_IDEMPOTENCY", "").lower() in ("1", "true", "yes")
+# Shared so the MX cache is reused across requests; None when validation is disabled
+recipient_validator = RecipientValidator.from_env()
+# Keys upstream answered 401/403 for, rejected locally until the TTL expires
+bad_key_cache = NegativeKeyCache.from_env()
+# Request scaffolding that never changes between sends
+SEND_URLS = upstream.url_map("/transactional/send")
+_http_client: Optional[httpx.AsyncClient] = None
+# In-flight sends, drained (or persisted) on shutdown
+drain_controller = DrainController.from_env()
+# Per-tenant (API-key hash) queues in front of the upstream concurrency limit;
+# queued sends were admitted before any drain, so they may still start during it
+scheduler = FairScheduler.from_env(
+    starter=lambda send, record: drain_controller.track(send, record, admitted=True)
+)
+drain_controller.add_pending_source(
+    lambda: scheduler.close(ShuttingDown("Server shut down before this send started"))
+)
+# Bulk sends wait here (compact, spilling to disk) until the dispatcher feeds them
+# to the scheduler; persisted after the scheduler's own queue on shutdown
+bulk_backlog = CompactBacklog.from_env()
+backlog_ready = asyncio.Event()
+bulk_stats = {"accepted": 0, "sent": 0, "failed": 0}
+BULK_MAX_MESSAGES = int(os.getenv("LEMON_EMAIL_BULK_MAX_MESSAGES", "10000"))
+
+drain_controller.add_pending_source(lambda: bulk_backlog.drain_records(hash_api_key))
+# Plain/Markdown bodies are rendered in worker processes, cached by content hash
+body_renderer = BodyRenderer.from_env()
+# /debug/* endpoints are only mounted when a token is configured
+DEBUG_TOKEN = os.getenv("LEMON_EMAIL_DEBUG_TOKEN")
+loop_monitor = profiling.LoopMonitor.from_env() if DEBUG_TOKEN else None
+
+def get_http_client() -> httpx.AsyncClient:
+    """Pooled HTTP client shared by all requests, created inside the running loop"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(timeout=30.0)
+    return _http_client
+
+async def close_http_client():
+    """Close pooled upstream connections"""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
 class LemonEmailServerWeb:
     """Modified LemonEmailServer for web API that accepts API key directly"""
-    def __init__(self, api_key: str = None):
-        self.api_base_url = os.getenv("LEMON_EMAIL_API_BASE_URL", "https://app.xn--lemn-sqa.com/api")
+    def __init__(self, api_key: str = None, pool: Optional[UpstreamPool] = None):
+        self.upstream = pool or upstream
+        self.api_base_url = self.upstream.primary_url
         self.api_key = api_key
         
         if not self.api_key:
@@ -27,6 +103,12 @@ class LemonEmailServerWeb:
             if not self.api_key:
                 # Don't raise error here - will be handled when trying to send
                 pass
+        
+        self.send_urls = SEND_URLS if self.upstream is upstream else self.upstream.url_map("/transactional/send")
+        self.headers = {
+            "Content-Type": "application/json",
+            "X-Auth-APIKey": self.api_key or ""
+        }
     
     async def send_email(
         self,
@@ -38,9 +120,13 @@ class LemonEmailServerWeb:
         toname: str = "",
         tag: str = "mcp-agent",
         variables: Optional[Dict[str, Any]] = None,
-        replyto: Optional[str] = None
+        replyto: Optional[str] = None,
+        attachments: Optional[List[AttachmentSource]] = None,
+        body_format: Optional[str] = None
     ) -> Dict[str, Any]:
-        """Send an email using the Lemon Email API"""
+        """Send an email using the Lemon Email API, streaming any attachments"""
+        
+        start = time.perf_counter()
         
         if not self.api_key:
             return {
@@ -48,6 +134,24 @@ class LemonEmailServerWeb:
                 "error": "API key is required"
             }
         
+        if recipient_validator:
+            error = await recipient_validator.validate(to)
+            if error:
+                return {
+                    "success": False,
+                    "error": f"Invalid recipient {to}: {error}"
+                }
+        
+        if body_format and body_format != "html":
+            try:
+                rendered = await body_renderer.render(body, body_format)
+            except Exception as e:
+                return {
+                    "success": False,
+                    "error": f"Could not render {body_format} body: {str(e)}"
+                }
+            body = rendered["html"]
+        
         if not replyto:
             replyto = fromemail
         
@@ -62,70 +166,140 @@ class LemonEmailServerWeb:
             "variables": variables or {},
             "replyto": replyto
         }
+        if body_format and body_format != "html" and TEXT_BODY_FIELD:
+            payload[TEXT_BODY_FIELD] = rendered["text"]
         
-        headers = {
-            "Content-Type": "application/json",
-            "X-Auth-APIKey": self.api_key
-        }
+        headers = self.headers
+        if API_IDEMPOTENCY:
+            headers = {**headers, "Idempotency-Key": uuid.uuid4().hex}
+        content = codec.dumps(payload)
+        body_stream = None
+        if attachments:
+            # A fresh stream per attempt so failover and hedging can re-send it
+            body_stream = attachment_streams.request_body(content, attachments, codec.dumps)
+            if attachment_streams.GZIP_ATTACHMENTS:
+                headers = {**headers, "Content-Encoding": "gzip"}
+        client = get_http_client()
         
-        url = f"{self.api_base_url}/transactional/send"
+        async def post(base_url: str):
+            return await client.post(
+                self.send_urls[base_url],
+                headers=headers,
+                content=body_stream() if body_stream else content
+            )
         
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.post(
-                    url, 
-                    headers=headers, 
-                    json=payload,
-                    timeout=30.0
-                )
-                
-                response_data = {
-                    "status_code": response.status_code,
-                    "response": response.text,
-                    "success": response.is_success
-                }
-                
-                if not response.is_success:
-                    response_data["error"] = f"API error {response.status_code}: {response.text}"
-                
-                return response_data
-                
-            except httpx.TimeoutException:
-                return {
-                    "success": False,
-                    "error": "Request timed out after 30 seconds"
-                }
-            except Exception as e:
-                return {
-                    "success": False,
-                    "error": f"Network error: {str(e)}"
-                }
+        try:
+            response, endpoint = await self.upstream.request(post, idempotent=API_IDEMPOTENCY)
+            
+            # The HTTP API has always returned the upstream reply as text;
+            # decoded once and reused for the error line
+            text = response.text
+            response_data = {
+                "status_code": response.status_code,
+                "response": text,
+                "success": response.is_success,
+                "endpoint": endpoint,
+                "elapsed_ms": round((time.perf_counter() - start) * 1000, 1)
+            }
+            
+            if not response.is_success:
+                response_data["error"] = f"API error {response.status_code}: {text}"
+            
+            return response_data
+            
+        except httpx.TimeoutException:
+            return {
+                "success": False,
+                "error": "Request timed out after 30 seconds"
+            }
+        except AttachmentError as e:
+            return {
+                "success": False,
+                "error": str(e)
+            }
+        except Exception as e:
+            return {
+                "success": False,
+                "error": f"Network error: {str(e)}"
+            }
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Drain in-flight sends and close upstream connections on shutdown"""
+    if loop_monitor:
+        loop_monitor.start()
+    dispatcher = asyncio.create_task(dispatch_backlog())
+    await body_renderer.start()
+    # Time uvicorn spends waiting on open requests comes out of the drain deadline
+    drain_controller.watch_signals()
+    yield
+    if loop_monitor:
+        await loop_monitor.stop()
+    drain_controller.mark_shutdown()
+    print("🛑 Shutting down, draining in-flight sends...")
+    # Close admission and stop feeding the backlog first, so the drain only
+    # waits on sends that had already started or been handed to the scheduler
+    drain_controller.stop_admitting()
+    dispatcher.cancel()
+    await asyncio.gather(dispatcher, return_exceptions=True)
+    # Bulk sends have no open request for uvicorn to wait on, so they get
+    # whatever is left of the deadline after uvicorn's graceful phase
+    report = await drain_controller.drain()
+    print(
+        f"📦 Drained in {report['drain_seconds']}s: {report['completed']} completed, "
+        f"{report['abandoned']} abandoned"
+        + (f" (saved to {report['pending_file']})" if report["saved"] else "")
+    )
+    bulk_backlog.clear()
+    body_renderer.shutdown()
+    await close_http_client()
 
 # FastAPI app
 app = FastAPI(
     title="Lemon Email MCP Server - Web Interface",
     description="Web wrapper for the Lemon Email MCP Server",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Initialize email server (for class definition only, users provide their own API key)
 email_server = None  # Not needed for public API mode
 
-# Pydantic models
-class EmailRequest(BaseModel):
-    # Email content
-    to: str
-    subject: str
-    body: str
-    fromname: str = "Email Assistant"
-    fromemail: str
-    toname: str = ""
-    tag: str = "web-api"
-    variables: Optional[Dict[str, Any]] = None
-    replyto: Optional[str] = None
-    
-    # User's API key
-    api_key: str
+# Request bodies are checked by the shared payload validator; these schemas
+# only document them in /docs
+WEB_DEFAULTS = {"fromname": "Email Assistant", "toname": "", "tag": "web-api"}
+
+def json_request_body(schema: Dict[str, Any]) -> Dict[str, Any]:
+    return {"requestBody": {"required": True, "content": {"application/json": {"schema": schema}}}}
+
+SEND_EMAIL_BODY = json_request_body(json_schema(SendEmailRequest))
+SEND_BULK_BODY = json_request_body({
+    "type": "object",
+    "properties": {
+        "messages": {"type": "array", "items": json_schema(EmailPayload)},
+        "api_key": {"type": "string", "minLength": 1}
+    },
+    "required": ["messages", "api_key"]
+})
+
+async def parse_json(request: Request) -> Any:
+    try:
+        return codec.loads(await request.body())
+    except ValueError as e:
+        raise HTTPException(
+            status_code=422,
+            detail=[error_detail("json_invalid", "JSON decode error", ("body", getattr(e, "pos", 0)), {})]
+        )
+
+def validated(data: Any, schema) -> Dict[str, Any]:
+    """Validate with the shared validator, answering 422 in FastAPI's error format"""
+    try:
+        return validator.validate(data, schema)
+    except PayloadError as e:
+        raise HTTPException(
+            status_code=422,
+            detail=[{**detail, "loc": ["body", *detail["loc"]]} for detail in e.details]
+        )
 
 @app.get("/")
 async def root():
@@ -168,6 +342,8 @@ async def root():
             <li><strong>GET /</strong> - This page</li>
             <li><strong>GET /health</strong> - Health check</li>
             <li><strong>POST /send-email</strong> - Send email via API</li>
+            <li><strong>POST /send-bulk</strong> - Queue a batch of emails (one API key)</li>
+            <li><strong>POST /send-email-with-attachments</strong> - Send email with file uploads (multipart)</li>
             <li><strong>GET /docs</strong> - API documentation</li>
         </ul>
     </div>
@@ -203,29 +379,106 @@ async def health_check():
         "service": "lemon-email-mcp-server",
         "version": "1.0.0",
         "mode": "public_api",
-        "description": "Users provide their own Lemon Email API keys"
+        "description": "Users provide their own Lemon Email API keys",
+        "upstreams": upstream.snapshot(),
+        "api_key_cache": bad_key_cache.stats(),
+        "in_flight_sends": drain_controller.in_flight,
+        "scheduler": scheduler.stats(top=0),
+        "bulk": {**bulk_stats, **bulk_backlog.stats()},
+        "rendering": body_renderer.stats()
     }
     
     return JSONResponse(status)
 
-@app.post("/send-email")
-async def send_email_api(email: EmailRequest, background_tasks: BackgroundTasks):
+@app.post("/send-email", openapi_extra=SEND_EMAIL_BODY)
+async def send_email_api(request: Request, background_tasks: BackgroundTasks):
     """Send email via REST API with user's API key"""
+    email = validated(await parse_json(request), SendEmailRequest)
+    api_key = email.pop("api_key")
+    return await deliver_email(api_key, {**WEB_DEFAULTS, **email})
+
+@app.post("/send-email-with-attachments")
+async def send_email_with_attachments_api(
+    to: str = Form(...),
+    subject: str = Form(...),
+    body: str = Form(...),
+    fromemail: str = Form(...),
+    api_key: str = Form(...),
+    fromname: str = Form("Email Assistant"),
+    toname: str = Form(""),
+    tag: str = Form("web-api"),
+    variables: Optional[str] = Form(None, description="JSON object of template variables"),
+    replyto: Optional[str] = Form(None),
+    body_format: Optional[str] = Form(None),
+    files: List[UploadFile] = File(...)
+):
+    """Send email with uploaded attachments (multipart/form-data)
+    
+    Uploads are spooled to disk by the framework and streamed to the upstream
+    in chunks, so large files never sit in memory whole.
+    """
+    try:
+        parsed_variables = json.loads(variables) if variables else None
+    except ValueError:
+        raise HTTPException(
+            status_code=422,
+            detail=[error_detail("json_invalid", "variables must be a JSON object", ("body", "variables"), variables)]
+        )
+    try:
+        sources = [
+            AttachmentSource.from_fileobj(
+                upload.file,
+                upload.filename or "attachment",
+                upload.content_type,
+                getattr(upload, "size", None)
+            )
+            for upload in files
+        ]
+    except AttachmentError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    
+    fields = validated({
+        "to": to,
+        "subject": subject,
+        "body": body,
+        "fromname": fromname,
+        "fromemail": fromemail,
+        "toname": toname,
+        "tag": tag,
+        "variables": parsed_variables,
+        "replyto": replyto,
+        "body_format": body_format or "html",
+        "api_key": api_key
+    }, SendEmailRequest)
+    return await deliver_email(fields.pop("api_key"), fields, sources)
+
+async def deliver_email(
+    api_key: str,
+    fields: Dict[str, Any],
+    attachments: Optional[List[AttachmentSource]] = None
+) -> Dict[str, Any]:
+    """Send one email through the fair scheduler, mapping failures to HTTP errors"""
+    
+    if bad_key_cache.is_rejected(api_key):
+        raise HTTPException(
+            status_code=401,
+            detail="API key was recently rejected by Lemon Email"
+        )
+    
+    # Attachment content can't be persisted; a pending record keeps their metadata
+    record = pending_record(fields, api_key)
+    if attachments:
+        record["attachments"] = [attachment.describe() for attachment in attachments]
     
     try:
         # Create email server instance with user's API key
-        user_email_server = LemonEmailServerWeb(api_key=email.api_key)
+        user_email_server = LemonEmailServerWeb(api_key=api_key)
         
-        result = await user_email_server.send_email(
-            to=email.to,
-            subject=email.subject,
-            body=email.body,
-            fromname=email.fromname,
-            fromemail=email.fromemail,
-            toname=email.toname,
-            tag=email.tag,
-            variables=email.variables,
-            replyto=email.replyto
+        drain_controller.admit()
+        result = await scheduler.submit(
+            hash_api_key(api_key),
+            lambda: user_email_server.send_email(**fields, attachments=attachments),
+            record
         )
         
         if result["success"]:
@@ -235,18 +488,171 @@ async def send_email_api(email: EmailRequest, background_tasks: BackgroundTasks)
                 "status_code": result["status_code"],
                 "response": result["response"]
             }
+        elif result.get("status_code") in REJECTED_STATUSES:
+            if rejects_key(result["status_code"], result.get("response")):
+                bad_key_cache.reject(api_key)
+            raise HTTPException(
+                status_code=result["status_code"],
+                detail=result.get("error", "API key rejected")
+            )
         else:
             raise HTTPException(
                 status_code=400,
                 detail=result.get("error", "Unknown error occurred")
             )
             
+    except HTTPException:
+        raise
+    except ShuttingDown as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": "5"}
+        )
+    except TenantQueueFull as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": "1"}
+        )
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Failed to send email: {str(e)}"
         )
 
+def require_debug_token(x_debug_token: Optional[str] = Header(None)):
+    """Guard for /debug/* - hidden unless LEMON_EMAIL_DEBUG_TOKEN is set"""
+    if not DEBUG_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_debug_token or not hmac.compare_digest(x_debug_token, DEBUG_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid debug token")
+
+@app.get("/debug/profile", dependencies=[Depends(require_debug_token)])
+async def debug_profile(
+    seconds: float = Query(5.0, gt=0, le=profiling.MAX_PROFILE_SECONDS),
+    mode: str = Query("sample", pattern="^(sample|cprofile)$")
+):
+    """Profile this worker's event loop: collapsed stacks (sample) or pstats (cprofile)"""
+    try:
+        report = await profiling.profile(seconds, mode)
+    except profiling.ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(report)
+
+@app.get("/debug/loop", dependencies=[Depends(require_debug_token)])
+async def debug_loop():
+    """Event-loop lag and recently captured slow callbacks for this worker"""
+    return {
+        "pid": os.getpid(),
+        "loop": loop_monitor.stats(),
+        "in_flight_sends": drain_controller.in_flight
+    }
+
+@app.post("/send-bulk", status_code=202, openapi_extra=SEND_BULK_BODY)
+async def send_bulk_api(request: Request):
+    """Queue a batch of emails for background delivery with user's API key"""
+    
+    bulk = validated(await parse_json(request), BulkEmailEnvelope)
+    api_key, messages = bulk["api_key"], bulk["messages"]
+    
+    if bad_key_cache.is_rejected(api_key):
+        raise HTTPException(
+            status_code=401,
+            detail="API key was recently rejected by Lemon Email"
+        )
+    if len(messages) > BULK_MAX_MESSAGES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many messages in one batch (limit {BULK_MAX_MESSAGES})"
+        )
+    try:
+        drain_controller.admit()
+    except ShuttingDown as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    
+    # The whole batch in one pass; invalid messages are reported, not fatal
+    payloads, invalid = validator.validate_many(messages)
+    rejected = []
+    for index, problems in invalid.items():
+        to = messages[index].get("to") if isinstance(messages[index], dict) else None
+        rejected.append({"index": index, "to": to, "error": "; ".join(problems)})
+    
+    errors: Dict[str, Optional[str]] = {}
+    if recipient_validator:
+        # One lookup per distinct domain across the whole batch
+        errors = await recipient_validator.validate_many(
+            payload["to"] for payload in payloads if payload is not None
+        )
+    
+    for index, payload in enumerate(payloads):
+        if payload is None:
+            continue
+        if errors.get(payload["to"]):
+            rejected.append({"index": index, "to": payload["to"], "error": errors[payload["to"]]})
+            continue
+        bulk_backlog.push({**WEB_DEFAULTS, **payload}, api_key)
+    
+    rejected.sort(key=lambda item: item["index"])
+    accepted = len(messages) - len(rejected)
+    bulk_stats["accepted"] += accepted
+    backlog_ready.set()
+    return {
+        "success": True,
+        "accepted": accepted,
+        "rejected": rejected,
+        "queued": len(bulk_backlog)
+    }
+
+def bulk_send_finished(future: asyncio.Future, api_key: str):
+    """Account for one bulk send and remember keys upstream rejected"""
+    if future.cancelled() or future.exception() is not None:
+        bulk_stats["failed"] += 1
+        return
+    result = future.result()
+    if result["success"]:
+        bulk_stats["sent"] += 1
+    else:
+        bulk_stats["failed"] += 1
+        if rejects_key(result.get("status_code"), result.get("response")):
+            bad_key_cache.reject(api_key)
+
+async def dispatch_backlog():
+    """Feed bulk sends from the backlog into the fair scheduler"""
+    # Keeps the scheduler's per-tenant queues short; the backlog is the real queue
+    slots = asyncio.Semaphore(scheduler.concurrency * 2)
+    while True:
+        await slots.acquire()
+        if scheduler.closed or not drain_controller.admitting:
+            return
+        item = bulk_backlog.pop()
+        if item is None:
+            slots.release()
+            backlog_ready.clear()
+            await backlog_ready.wait()
+            continue
+        
+        payload, api_key = item
+        if bad_key_cache.is_rejected(api_key):
+            bulk_stats["failed"] += 1
+            slots.release()
+            continue
+        
+        user_email_server = LemonEmailServerWeb(api_key=api_key)
+        try:
+            # Synchronous hand-off: an item is always either in the backlog or the scheduler
+            future = scheduler.enqueue(
+                hash_api_key(api_key),
+                lambda server=user_email_server, payload=payload: server.send_email(**payload),
+                pending_record(payload, api_key)
+            )
+        except TenantQueueFull:
+            bulk_backlog.push(payload, api_key)
+            slots.release()
+            await asyncio.sleep(0.1)
+            continue
+        future.add_done_callback(lambda f, key=api_key: (slots.release(), bulk_send_finished(f, key)))
+
 @app.get("/mcp-info")
 async def mcp_info():
     """Information about MCP integration"""
@@ -261,7 +667,7 @@ async def mcp_info():
                     "name": "send_email",
                     "description": "Send transactional emails",
                     "required_params": ["to", "subject", "body", "fromemail"],
-                    "optional_params": ["fromname", "toname", "tag", "variables", "replyto"]
+                    "optional_params": ["fromname", "toname", "tag", "variables", "replyto", "attachments", "body_format"]
                 }
             ]
         },
@@ -280,15 +686,21 @@ def run_mcp_in_background():
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8000))
+    performance = runtime_mode.performance_mode_enabled()
     
     print("🍋 Starting Lemon Email MCP Server - Web Mode")
     print(f"🌐 Port: {port}")
     print(f"🔑 API Key configured: {bool(os.getenv('LEMON_EMAIL_API_KEY'))}")
+    print(f"⚙️  Runtime: {runtime_mode.describe(performance)}")
     print("🚀 Starting server...")
     
     uvicorn.run(
         "web_server:app",
         host="0.0.0.0",
         port=port,
-        reload=False
+        reload=False,
+        # Open requests get the drain deadline (whole seconds, rounded up); the
+        # lifespan drain afterwards only gets what is left of it
+        timeout_graceful_shutdown=math.ceil(drain_controller.deadline),
+        **runtime_mode.uvicorn_options(performance)
     )
\ No newline at end of file